@@ -0,0 +1,294 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import cv2
+import numpy as np
+from extract_hashes import extract_hashes
+from image_matcher import ImageMatcher
+from lazy_matcher import LazyMatcher
+from sharded_matcher import ShardedMatcher
+from synthetic_dataset import DEFAULT_REGIONS, DEFAULT_SLUGCATS, generate_dataset, generate_events
+import interpret_csv
+import interpret_overview_table
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+# Run in a fresh process per measurement: prints the growth of the resident memory while loading the index of argv[1]
+# with ImageMatcher, or with LazyMatcher and a memory budget of argv[3] MB while matching the packed hashes in the .npy
+# file argv[2] one by one. numpy, OpenCV and the matchers are imported before, so only the index is measured.
+RESIDENT_MEMORY_SCRIPT = """
+import json, sys
+import numpy as np
+from image_matcher import ImageMatcher
+from lazy_matcher import LazyMatcher
+from metrics import resident_memory_bytes
+base_dir, queries_file, memory_budget_mb, top_n = sys.argv[1], sys.argv[2], json.loads(sys.argv[3]), int(sys.argv[4])
+queries = np.load(queries_file) if queries_file else None
+before = resident_memory_bytes()
+if queries is None:
+    matcher = ImageMatcher(base_dir)
+else:
+    matcher = LazyMatcher(base_dir, memory_budget_mb=memory_budget_mb)
+    for packed_hash in queries:
+        matcher.match_hashes_top_n(packed_hash[np.newaxis], top_n)
+after = resident_memory_bytes()
+print(json.dumps(after - before if before is not None and after is not None else None))
+"""
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Time hash extraction, index loading, matching and the location '
+                                                 'summaries on synthetic datasets of several sizes.')
+    parser.add_argument('--scales', default='10,50,200',
+                        help='Comma-separated numbers of rooms per region, one dataset is generated for each.')
+    parser.add_argument('--slugcats', default=','.join(DEFAULT_SLUGCATS), help='Comma-separated slugcat names.')
+    parser.add_argument('--regions', default=','.join(DEFAULT_REGIONS), help='Comma-separated region acronyms.')
+    parser.add_argument('--cameras', type=int, default=2, help='Number of screenshots per room.')
+    parser.add_argument('--width', type=int, default=320, help='Width of the screenshots in pixels.')
+    parser.add_argument('--height', type=int, default=180, help='Height of the screenshots in pixels.')
+    parser.add_argument('--queries', type=int, default=50, help='Number of images matched per measurement.')
+    parser.add_argument('--top_n', type=int, default=5, help='n passed to match_image_top_n.')
+    parser.add_argument('--events_per_room', type=int, default=20,
+                        help='Number of synthetic events per room passed to summarize_locations.')
+    parser.add_argument('--compact_distance', type=int,
+                        help='Also time matching with the index compacted within this many bits.')
+    parser.add_argument('--shards', default='',
+                        help='Comma-separated numbers of shards to also time matching with, for example "2,4".')
+    parser.add_argument('--memory_budget_mb', type=float,
+                        help='Memory budget of the lazily loading matcher that is also timed. Default is no limit.')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of times every measurement is repeated.')
+    parser.add_argument('--work_dir', help='Directory for the generated datasets. Default is a temporary directory.')
+    parser.add_argument('--output', default='benchmark_matcher.json', help='JSON file to write the results to.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator.')
+    return parser.parse_args()
+
+
+def measure(function, repeat):
+    """Calls function repeat times and returns the statistics of the durations in seconds."""
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - started)
+    return duration_statistics(durations)
+
+
+def duration_statistics(durations):
+    repeat = len(durations)
+    return {
+        'min_s': round(min(durations), 6),
+        'median_s': round(float(np.median(durations)), 6),
+        'mean_s': round(float(np.mean(durations)), 6),
+        'repeat': repeat,
+    }
+
+
+def per_item(timing, items):
+    """Adds the duration per item and the items per second, based on the fastest repetition."""
+    timing['items'] = items
+    timing['min_per_item_ms'] = round(timing['min_s'] / items * 1000, 4)
+    timing['items_per_second'] = round(items / timing['min_s'], 1) if timing['min_s'] > 0 else None
+    return timing
+
+
+def resident_memory(base_dir, packed_queries=None, memory_budget_mb=None, top_n=1):
+    """
+    Bytes the resident memory of a fresh process grows by while loading the index, or while a LazyMatcher matches the
+    packed query hashes if they are given. Unlike traced allocations, this includes the allocator overhead and the
+    memory freed while loading that is not returned to the system. None if it cannot be measured on this platform.
+    """
+    with tempfile.TemporaryDirectory(prefix='rwl-queries-') as temp_dir:
+        queries_file = ''
+        if packed_queries is not None:
+            queries_file = os.path.join(temp_dir, 'queries.npy')
+            np.save(queries_file, packed_queries)
+        result = subprocess.run([sys.executable, '-c', RESIDENT_MEMORY_SCRIPT, base_dir, queries_file,
+                                 json.dumps(memory_budget_mb), str(top_n)],
+                                capture_output=True, text=True, cwd=SCRIPT_DIR, check=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def traced_memory(function):
+    """Bytes traced by tracemalloc that are still allocated after calling function, and its result."""
+    tracemalloc.start()
+    result = function()
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return memory, result
+
+
+def index_memory(base_dir):
+    """Resident and traced bytes of a loaded index."""
+    traced, _ = traced_memory(lambda: ImageMatcher(base_dir))
+    return {'resident_bytes': resident_memory(base_dir), 'traced_bytes': traced}
+
+
+def lazy_first_query(base_dir, image, args, search_filter=None):
+    """Statistics of the duration of the first query of a freshly started LazyMatcher, which loads the shards."""
+    durations = []
+    for _ in range(args.repeat):
+        matcher = LazyMatcher(base_dir, search_filter, memory_budget_mb=args.memory_budget_mb)
+        started = time.perf_counter()
+        matcher.match_image_top_n(image, args.top_n)
+        durations.append(time.perf_counter() - started)
+    return duration_statistics(durations)
+
+
+def lazy_memory(base_dir, queries, args):
+    """
+    Resident and traced bytes of the loaded shards of a LazyMatcher after matching all queries, and its shard
+    statistics.
+    """
+    def match_queries():
+        matcher = LazyMatcher(base_dir, memory_budget_mb=args.memory_budget_mb)
+        for image in queries:
+            matcher.match_image_top_n(image, args.top_n)
+        return matcher
+
+    traced, matcher = traced_memory(match_queries)
+    info = matcher.index_info()
+    packed_queries = matcher.hash_images(queries)
+    return {'resident_bytes': resident_memory(base_dir, packed_queries, args.memory_budget_mb, args.top_n),
+            'traced_bytes': traced, 'memory_budget_mb': args.memory_budget_mb, 'loaded_shards': info['loaded_shards'],
+            'shard_loads': info['shard_loads'], 'shard_evictions': info['shard_evictions']}
+
+
+def environment():
+    info = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'commit': None,
+    }
+    try:
+        info['commit'] = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                        cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        pass
+    return info
+
+
+def run_scale(base_dir, rooms, args):
+    slugcats = [item.strip() for item in args.slugcats.split(',')]
+    regions = [item.strip() for item in args.regions.split(',')]
+    entries = generate_dataset(base_dir, slugcats, regions, rooms, args.cameras, args.width, args.height, args.seed)
+    print(f"Generated {len(entries)} screenshots ({rooms} rooms per region)")
+
+    rng = np.random.default_rng(args.seed)
+    query_entries = [entries[index] for index in rng.integers(len(entries), size=args.queries)]
+    queries = [cv2.imread(entry['path']) for entry in query_entries]
+
+    timings = {'extract_hashes': per_item(measure(lambda: extract_hashes(base_dir, verbose=False), args.repeat),
+                                          len(entries))}
+    matcher = ImageMatcher(base_dir)
+    timings['load_hashes'] = per_item(measure(matcher.load_hashes, args.repeat), len(entries))
+    timings['load_index'] = per_item(measure(lambda: ImageMatcher(base_dir), args.repeat), len(entries))
+
+    def match_all(searched):
+        for image in queries:
+            searched.match_image(image)
+
+    def match_all_top_n(searched, group_by_room=False):
+        for image in queries:
+            searched.match_image_top_n(image, args.top_n, group_by_room)
+
+    def time_matching(searched, suffix='', top_1=True):
+        if top_1:
+            timings[f'match_image{suffix}'] = per_item(measure(lambda: match_all(searched), args.repeat), len(queries))
+        timings[f'match_image_top_n{suffix}'] = per_item(measure(lambda: match_all_top_n(searched), args.repeat),
+                                                         len(queries))
+        timings[f'match_image_top_n_grouped{suffix}'] = per_item(
+            measure(lambda: match_all_top_n(searched, True), args.repeat), len(queries))
+
+    time_matching(matcher)
+    compaction = None
+    if args.compact_distance is not None:
+        timings['load_index_compacted'] = per_item(
+            measure(lambda: ImageMatcher(base_dir, compact_distance=args.compact_distance), args.repeat), len(entries))
+        compacted = ImageMatcher(base_dir, compact_distance=args.compact_distance)
+        time_matching(compacted, '_compacted')
+        info = compacted.index_info()
+        compaction = {key: info[key] for key in ('compact_distance', 'representatives', 'compression_ratio')}
+
+    timings['lazy_startup'] = per_item(
+        measure(lambda: LazyMatcher(base_dir, memory_budget_mb=args.memory_budget_mb), args.repeat), len(entries))
+    timings['lazy_first_query'] = per_item(lazy_first_query(base_dir, queries[0], args), 1)
+    timings['lazy_first_query_one_region'] = per_item(
+        lazy_first_query(base_dir, queries[0], args, f"{slugcats[0]}/{regions[0]}"), 1)
+    lazy = LazyMatcher(base_dir, memory_budget_mb=args.memory_budget_mb)
+    match_all_top_n(lazy)
+    time_matching(lazy, '_lazy', top_1=False)
+
+    for shards in [int(item) for item in args.shards.split(',') if item.strip()]:
+        sharded = ShardedMatcher(base_dir, shards=shards)
+        time_matching(sharded, f'_{shards}_shards', top_1=False)
+        sharded.close()
+
+    events = generate_events(entries, rooms * len(regions) * len(slugcats) * args.events_per_room, seed=args.seed)
+    timings['interpret_csv.summarize_locations'] = per_item(
+        measure(lambda: interpret_csv.summarize_locations(list(events)), args.repeat), len(events))
+    timings['interpret_overview_table.summarize_locations'] = per_item(
+        measure(lambda: interpret_overview_table.summarize_locations(list(events)), args.repeat), len(events))
+
+    correct = sum(matcher.match_image(image)['filename'] == entry['filename']
+                  for image, entry in zip(queries, query_entries))
+    return {
+        'rooms_per_region': rooms,
+        'screenshots': len(entries),
+        'events': len(events),
+        'index_bytes': int(matcher.hash_matrix.nbytes),
+        'index_memory': index_memory(base_dir),
+        'top_1_correct': round(correct / len(queries), 4) if queries else None,
+        'compaction': compaction,
+        'lazy': lazy_memory(base_dir, queries, args),
+        'timings': timings,
+    }
+
+
+def format_resident(memory):
+    return f"{memory['resident_bytes'] / 1e6:.2f} MB resident" if memory['resident_bytes'] is not None else \
+        'unknown resident memory'
+
+
+def print_scale(result):
+    memory = result['index_memory']
+    print(f"{result['screenshots']} screenshots, {result['events']} events, {format_resident(memory)} "
+          f"({memory['traced_bytes'] / 1e6:.2f} MB traced allocations) for the loaded index:")
+    lazy = result['lazy']
+    print(f"  lazy loading: {format_resident(lazy)} ({lazy['traced_bytes'] / 1e6:.2f} MB traced allocations) "
+          f"after all queries, {lazy['loaded_shards']} shards loaded, {lazy['shard_evictions']} evicted")
+    if result['compaction']:
+        print(f"  {result['compaction']['representatives']} representatives within "
+              f"{result['compaction']['compact_distance']} bits ({result['compaction']['compression_ratio']}x)")
+    for name, timing in result['timings'].items():
+        print(f"  {name:<48} {timing['min_s'] * 1000:>10.2f} ms  {timing['min_per_item_ms']:>9.4f} ms/item  "
+              f"{timing['items_per_second'] or 0:>12.1f} items/s")
+
+
+def main():
+    args = parse_arguments()
+    scales = [int(item) for item in args.scales.split(',')]
+    results = {'environment': environment(), 'arguments': vars(args), 'scales': []}
+
+    with tempfile.TemporaryDirectory(prefix='rwl-benchmark-') as temp_dir:
+        work_dir = args.work_dir or temp_dir
+        for rooms in scales:
+            result = run_scale(os.path.join(work_dir, f"rooms_{rooms}"), rooms, args)
+            print_scale(result)
+            results['scales'].append(result)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+import cv2
+import numpy as np
+from extract_hashes import extract_hashes
+from image_matcher import ImageMatcher
+from process_video import DECODE_MODES, process_video
+from stage_profiler import StageProfiler
+from synthetic_dataset import generate_dataset, generate_route
+from benchmark_matcher import environment
+
+# Container used for every codec that is not listed here
+CODEC_EXTENSIONS = {'MJPG': 'avi', 'XVID': 'avi', 'mp4v': 'mp4', 'avc1': 'mp4', 'VP80': 'webm', 'VP90': 'webm'}
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Measure the real-time factor and accuracy of process_video.py on '
+                                                 'synthetic videos with a known sequence of rooms.')
+    parser.add_argument('--slugcats', default='white', help='Comma-separated slugcat names of the synthetic dataset.')
+    parser.add_argument('--regions', default='su,hi', help='Comma-separated region acronyms of the synthetic dataset.')
+    parser.add_argument('--rooms', type=int, default=20, help='Number of rooms per region.')
+    parser.add_argument('--width', type=int, default=640, help='Width of the screenshots and the video in pixels.')
+    parser.add_argument('--height', type=int, default=360, help='Height of the screenshots and the video in pixels.')
+    parser.add_argument('--fps', type=float, default=30.0, help='Frame rate of the video.')
+    parser.add_argument('--segments', type=int, default=24, help='Number of rooms visited in the video.')
+    parser.add_argument('--segment_duration', type=float, default=10.0, help='Seconds spent in every room.')
+    parser.add_argument('--noise', type=int, default=6, help='Amplitude of the noise added to the video frames.')
+    parser.add_argument('--codecs', default='mp4v,MJPG', help='Comma-separated FourCC codes to encode the video with.')
+    parser.add_argument('--keyframe_intervals', default='12,250',
+                        help='Comma-separated keyframe intervals in frames to request from the encoder.')
+    parser.add_argument('--intervals', default='1,5,10', help='Comma-separated sampling intervals in seconds.')
+    parser.add_argument('--decode_modes', default=','.join(DECODE_MODES),
+                        help='Comma-separated decode modes of process_video.py.')
+    parser.add_argument('--work_dir', help='Directory for the dataset and videos. Default is a temporary directory.')
+    parser.add_argument('--output', default='benchmark_video.json', help='JSON file to write the results to.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator.')
+    return parser.parse_args()
+
+
+def render_video(path, route, codec, keyframe_interval, fps, width, height, segment_duration, noise, seed):
+    """
+    Encodes every screenshot of the route for segment_duration seconds, with noise that changes every frame.
+    Returns False if OpenCV cannot encode the codec.
+    """
+    os.environ['OPENCV_FFMPEG_WRITER_OPTIONS'] = f"g;{keyframe_interval}"
+    writer = cv2.VideoWriter(path, cv2.CAP_FFMPEG, cv2.VideoWriter_fourcc(*codec), fps, (width, height),
+                             [cv2.VIDEOWRITER_PROP_KEY_INTERVAL, keyframe_interval])
+    del os.environ['OPENCV_FFMPEG_WRITER_OPTIONS']
+    if not writer.isOpened():
+        return False
+
+    # A handful of noise patterns is enough to make consecutive frames differ, and much faster than fresh noise
+    rng = np.random.default_rng(seed)
+    noise_patterns = [rng.integers(-noise, noise + 1, (height, width, 3), dtype=np.int16) for _ in range(7)]
+    frames_per_segment = int(round(fps * segment_duration))
+    frame_index = 0
+    for entry in route:
+        image = cv2.imread(entry['path'])
+        image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA).astype(np.int16)
+        for _ in range(frames_per_segment):
+            frame = np.clip(image + noise_patterns[frame_index % len(noise_patterns)], 0, 255).astype(np.uint8)
+            writer.write(frame)
+            frame_index += 1
+    writer.release()
+    return True
+
+
+def keyframe_interval_of(path):
+    """The mean distance between keyframes actually written, read from the packets of the video."""
+    cap = cv2.VideoCapture(path, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+    packets = 0
+    keyframes = 0
+    while cap.grab():
+        packets += 1
+        keyframes += int(cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME))
+    cap.release()
+    return round(packets / keyframes, 2) if keyframes else None
+
+
+def run_video(matcher, video_path, route, interval, decode_mode, segment_duration):
+    profiler = StageProfiler()
+    matcher.profiler = profiler
+    timestamps = []
+
+    def on_progress(frames_processed, position, duration):
+        timestamps.append(position)
+
+    started = time.perf_counter()
+    results = process_video(matcher, video_path, interval=interval, on_progress=on_progress, verbose=False,
+                            profiler=profiler, decode_mode=decode_mode)
+    wall_time = time.perf_counter() - started
+
+    # Every processed frame has a result, as there always is a closest screenshot
+    correct_rooms = 0
+    correct_screenshots = 0
+    for position, result in zip(timestamps, results):
+        expected = route[min(int(position / segment_duration + 1e-9), len(route) - 1)]
+        if (result['slugcat'], result['region'], result['room_key']) == \
+                (expected['slugcat'], expected['region'], expected['room_key']):
+            correct_rooms += 1
+            correct_screenshots += result['filename'] == expected['filename']
+    video_duration = len(route) * segment_duration
+    summary = profiler.summary()
+    return {
+        'interval_s': interval,
+        'decode_mode': decode_mode,
+        'frames': len(results),
+        'wall_time_s': round(wall_time, 4),
+        'real_time_factor': round(video_duration / wall_time, 2) if wall_time > 0 else None,
+        'frames_per_second': round(len(results) / wall_time, 2) if wall_time > 0 else None,
+        'room_accuracy': round(correct_rooms / len(results), 4) if results else None,
+        'screenshot_accuracy': round(correct_screenshots / len(results), 4) if results else None,
+        'stages_mean_ms': {name: stage['mean_ms'] for name, stage in summary['stages'].items()},
+        'stages_total_s': {name: stage['total_s'] for name, stage in summary['stages'].items()},
+    }
+
+
+def main():
+    args = parse_arguments()
+    slugcats = [item.strip() for item in args.slugcats.split(',')]
+    regions = [item.strip() for item in args.regions.split(',')]
+    codecs = [item.strip() for item in args.codecs.split(',')]
+    keyframe_intervals = [int(item) for item in args.keyframe_intervals.split(',')]
+    intervals = [float(item) for item in args.intervals.split(',')]
+    decode_modes = [item.strip() for item in args.decode_modes.split(',')]
+    results = {'environment': environment(), 'arguments': vars(args), 'videos': []}
+
+    with tempfile.TemporaryDirectory(prefix='rwl-benchmark-') as temp_dir:
+        work_dir = args.work_dir or temp_dir
+        dataset_dir = os.path.join(work_dir, 'dataset')
+        entries = generate_dataset(dataset_dir, slugcats, regions, args.rooms, 2, args.width, args.height, args.seed)
+        extract_hashes(dataset_dir, verbose=False)
+        matcher = ImageMatcher(dataset_dir)
+        route = generate_route(entries, args.segments, args.seed)
+        video_duration = args.segments * args.segment_duration
+        print(f"Dataset of {len(entries)} screenshots, videos of {video_duration:.0f}s with {len(route)} rooms")
+
+        for codec in codecs:
+            for keyframe_interval in keyframe_intervals:
+                extension = CODEC_EXTENSIONS.get(codec, 'avi')
+                video_path = os.path.join(work_dir, f"video_{codec}_g{keyframe_interval}.{extension}")
+                started = time.perf_counter()
+                if not render_video(video_path, route, codec, keyframe_interval, args.fps, args.width, args.height,
+                                    args.segment_duration, args.noise, args.seed):
+                    print(f"Warning: OpenCV is unable to encode {codec}, skipping it")
+                    break
+                video = {
+                    'codec': codec,
+                    'keyframe_interval_requested': keyframe_interval,
+                    'keyframe_interval_measured': keyframe_interval_of(video_path),
+                    'encode_time_s': round(time.perf_counter() - started, 2),
+                    'file_bytes': os.path.getsize(video_path),
+                    'runs': [],
+                }
+                print(f"{codec}, keyframe interval {keyframe_interval} "
+                      f"(measured {video['keyframe_interval_measured']}), {video['file_bytes'] / 1e6:.1f} MB:")
+                for interval in intervals:
+                    for decode_mode in decode_modes:
+                        run = run_video(matcher, video_path, route, interval, decode_mode,
+                                        args.segment_duration)
+                        video['runs'].append(run)
+                        print(f"  interval {interval:>5g}s {decode_mode:<5} {run['frames']:>6} frames  "
+                              f"{run['real_time_factor']:>8.1f}x real-time  {run['frames_per_second']:>8.1f} fps  "
+                              f"room accuracy {run['room_accuracy']:.1%}")
+                results['videos'].append(video)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from rwlocate import COMMANDS
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BUDGET_FILE = os.path.join(SCRIPT_DIR, 'startup_budget.json')
+# With --update, the budget is at least this many milliseconds above the measured time, as short startups vary more
+MIN_HEADROOM_MS = 40
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the startup time of every rwlocate.py command, the time of '
+                                                 '"rwlocate.py COMMAND --help" beyond the start of a bare Python '
+                                                 'interpreter, and check it against a budget.')
+    parser.add_argument('commands', nargs='*', help='Commands to measure. Default is all commands.')
+    parser.add_argument('--budget_file', default=DEFAULT_BUDGET_FILE,
+                        help='JSON file with the budget of every command in milliseconds beyond the start of a bare '
+                             'Python interpreter. Default is startup_budget.json next to this script.')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Start every command this many times and keep the fastest start. Default is 5.')
+    parser.add_argument('--update', action='store_true',
+                        help='Write the measured times with a margin of --margin to the budget file instead of '
+                             'checking them.')
+    parser.add_argument('--margin', type=float, default=2.0,
+                        help=f'With --update, the budget is the measured time times this factor, and at least '
+                             f'{MIN_HEADROOM_MS} ms more than the measured time. Default is 2.')
+    return parser.parse_args(argv)
+
+
+def startup_duration(arguments):
+    """Seconds it takes to run the Python interpreter with the arguments."""
+    started = time.perf_counter()
+    subprocess.run([sys.executable] + arguments, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - started
+
+
+def fastest_start(arguments, repeat):
+    """Milliseconds of the fastest of repeat runs of the Python interpreter with the arguments."""
+    return min(startup_duration(arguments) for _ in range(max(repeat, 1))) * 1000
+
+
+def slowest_imports(command, count=5):
+    """(cumulative microseconds, module) of the slowest imports of the command, per -X importtime."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', os.path.join(SCRIPT_DIR, 'rwlocate.py'), command,
+                             '--help'], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split('|')
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            module = fields[2].lstrip()
+            # Only top level imports, nested ones are indented further and included in their cumulative time
+            if len(fields[2]) - len(module) == 1:
+                imports.append((int(fields[1]), module.rstrip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    commands = args.commands or list(COMMANDS)
+    unknown = [command for command in commands if command not in COMMANDS]
+    if unknown:
+        print(f"Error: Unknown commands: {', '.join(unknown)}")
+        sys.exit(2)
+
+    budget = {}
+    if os.path.exists(args.budget_file):
+        with open(args.budget_file, 'r') as f:
+            budget = json.load(f)
+    elif not args.update:
+        print(f"Error: Budget file {args.budget_file} not found, create it with --update.")
+        sys.exit(2)
+
+    # Budgets are relative to the start of the interpreter itself, which depends on the machine far more than the
+    # imports of the commands do
+    baseline = fastest_start(['-c', 'pass'], args.repeat)
+    print(f"{'python':<10} {baseline:8.1f} ms  (baseline, the times below are beyond it)")
+    measured = {}
+    over_budget = []
+    for command in commands:
+        milliseconds = fastest_start([os.path.join(SCRIPT_DIR, 'rwlocate.py'), command, '--help'],
+                                     args.repeat) - baseline
+        measured[command] = milliseconds
+        limit = budget.get(command)
+        if args.update or limit is None:
+            status = '' if args.update else '(no budget)'
+        elif milliseconds > limit:
+            status = 'OVER BUDGET'
+            over_budget.append(command)
+        else:
+            status = 'ok'
+        limit_text = f"{limit:.0f} ms" if limit is not None else '-'
+        print(f"{command:<10} {milliseconds:+8.1f} ms  budget {limit_text:>8}  {status}")
+
+    if args.update:
+        budget.update({command: round(max(milliseconds * args.margin, milliseconds + MIN_HEADROOM_MS))
+                       for command, milliseconds in measured.items()})
+        with open(args.budget_file, 'w') as f:
+            json.dump(budget, f, indent=4)
+            f.write('\n')
+        print(f"Budget written to {args.budget_file}")
+        return
+
+    for command in over_budget:
+        print(f"\nSlowest imports of {command}:")
+        for microseconds, module in slowest_imports(command):
+            print(f"  {microseconds / 1000:8.1f} ms  {module}")
+    if over_budget:
+        print(f"\nError: Startup over budget for {', '.join(over_budget)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
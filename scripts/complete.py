@@ -1,13 +1,18 @@
 #!/usr/bin/env python3
 
 import argparse
+import json
 import os
-import subprocess
 import sys
-import shutil
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from stage_cache import StageCache, file_identity, fingerprint
 
+STAGES = ('video', 'transcript', 'report')
 
-def parse_arguments():
+
+def parse_arguments(argv=None):
     parser = argparse.ArgumentParser(description="Automate the Rain World Region Locator process.")
     parser.add_argument('video_file', help='Path to the input video file.')
     parser.add_argument('--search_filter', help='Comma-separated list of slugcat/region pairs or slugcat names.')
@@ -19,11 +24,30 @@ def parse_arguments():
     parser.add_argument('--base_url', default='http://localhost:11434', help='Base URL for the language model API.')
     parser.add_argument('--output_dir', help='Directory to save the outputs. Defaults to the video file directory.')
     parser.add_argument('--screenshots_dir', help='Path to the Rain World screenshots directory.')
-    return parser.parse_args()
-
-
-def main():
-    args = parse_arguments()
+    parser.add_argument('--report_interval', type=int, default=5,
+                        help='Interval of the rows of the overview table in minutes. Default is 5.')
+    parser.add_argument('--all_transcripts', action='store_true',
+                        help='Show every transcript summary overlapping a row of the overview table, see '
+                             'interpret_overview_table.py.')
+    parser.add_argument('--force', action='append', choices=STAGES + ('all',), default=[],
+                        help='Run this stage even if its inputs did not change since the last run. Can be repeated.')
+    return parser.parse_args(argv)
+
+
+def exit_without_waiting(executor):
+    """
+    Exits with an error at once. The summarization running in the executor is abandoned: sys.exit would wait for it
+    to finish first, which can take minutes of language model requests. Its output is not recorded in the stage cache,
+    so the next run summarizes the transcript again.
+    """
+    executor.shutdown(wait=False, cancel_futures=True)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(1)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
 
     # Validate video file
     if not os.path.isfile(args.video_file):
@@ -60,47 +84,102 @@ def main():
     json_file = os.path.join(output_dir, f"{base_name}.json")
     html_file = os.path.join(screenshots_base_dir, f"{base_name}.html")
 
-    # Process the video
-    print("Processing video...")
-    process_video_cmd = [
-        sys.executable, 'process_video.py',
-        args.video_file,
-        screenshots_base_dir,
-        '--search_filter', search_filter,
-        '--start_time', str(args.start_time),
-        '--interval', str(args.interval)
-    ]
-    print(' '.join(process_video_cmd))
-    subprocess.run(process_video_cmd, check=True)
-
-    # Summarize the transcript if provided
+    # The stages are only imported here, as importing them takes longer than parsing the arguments
+    from interpret_overview_table import write_reports
+    from lazy_matcher import LazyMatcher
+    from process_video import create_matcher, process_video
+
+    # Every stage records the fingerprint of its inputs, a stage whose inputs did not change reuses its last output
+    cache = StageCache(os.path.join(output_dir, f"{base_name}-stages.json"))
+    forced = set(STAGES) if 'all' in args.force else set(args.force)
+    # A lazy matcher only lists the hash files, which is enough for the version of the index
+    index_signature = LazyMatcher(screenshots_base_dir, search_filter).signature
+    video_inputs = {
+        'video': file_identity(args.video_file),
+        'index': fingerprint(index_signature),
+        'search_filter': search_filter,
+        'start_time': args.start_time,
+        'interval': args.interval,
+    }
+    summary_json = os.path.join(output_dir, f"{base_name}-summary.json")
+    transcript_inputs = None
     if args.transcript_file:
+        from CompletionClient import CompletionClient
+        from transcript_summarizer import BATCH_PROMPT, FINAL_PROMPT, summarize_transcript
+
+        transcript_inputs = {
+            'transcript': file_identity(args.transcript_file),
+            'model': args.model,
+            'prompt': fingerprint([BATCH_PROMPT, FINAL_PROMPT]),
+        }
+
+    def reusable(stage, inputs, output_file):
+        record = None if stage in forced else cache.reusable(stage, inputs, output_file)
+        if record is not None:
+            print(f"Reusing the {stage} output {output_file} from {record['completed_at']}, its inputs did not change.")
+        return record is not None
+
+    # The summarization mostly waits for the language model, so it runs in a thread while the video is processed
+    started = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='transcript-summarizer')
+    transcript_future = None
+    transcript_data = None
+    reused = []
+    if transcript_inputs is not None and reusable('transcript', transcript_inputs, summary_json):
+        with open(summary_json, 'r') as f:
+            transcript_data = json.load(f)
+        reused.append('transcript')
+    elif transcript_inputs is not None:
         print("Summarizing video transcript...")
-        summary_json = os.path.join(output_dir, f"{base_name}-summary.json")
-        transcript_summarizer_cmd = [
-            sys.executable, 'transcript_summarizer.py',
-            args.transcript_file,
-            '--output_file', summary_json,
-            '--base_url', args.base_url,
-            '--model', args.model
-        ]
-        print(' '.join(transcript_summarizer_cmd))
-        subprocess.run(transcript_summarizer_cmd, check=True)
-
-    # Generate the HTML overview table
-    print("Generating HTML overview table...")
-    interpret_cmd = [
-        sys.executable, 'interpret_overview_table.py',
-        json_file,
-        '--format', 'html',
-        '--output_file', html_file
-    ]
-    if args.transcript_file:
-        interpret_cmd.extend(['--transcript_file', summary_json])
-
-    print(' '.join(interpret_cmd))
-    subprocess.run(interpret_cmd, check=True)
-
+        client = CompletionClient(base_url=args.base_url, model=args.model)
+        transcript_future = executor.submit(summarize_transcript, client, args.transcript_file,
+                                            output_file=summary_json)
+
+    if reusable('video', video_inputs, json_file):
+        with open(json_file, 'r') as f:
+            events = json.load(f)
+        reused.append('video')
+    else:
+        print("Processing video...")
+        try:
+            matcher = create_matcher(screenshots_base_dir, search_filter)
+            events = process_video(matcher, args.video_file, interval=args.interval, start_time=args.start_time,
+                                   json_filename=json_file)
+        except Exception:
+            traceback.print_exc()
+            events = None
+        if events is None:
+            print("Error: Processing the video failed, stopping without waiting for the transcript summary.")
+            exit_without_waiting(executor)
+        cache.record('video', video_inputs, json_file)
+        print(f"Video processed in {time.perf_counter() - started:.1f}s, results saved to {json_file}")
+
+    if transcript_future is not None:
+        transcript_data = transcript_future.result()
+        cache.record('transcript', transcript_inputs, summary_json)
+        print(f"Transcript summarized, {time.perf_counter() - started:.1f}s since the start")
+    executor.shutdown()
+
+    # The report depends on the outputs of the other stages through their fingerprints
+    report_inputs = {
+        'video': fingerprint(video_inputs),
+        'transcript': fingerprint(transcript_inputs) if transcript_inputs is not None else None,
+        'interval': args.report_interval,
+        'all_transcripts': args.all_transcripts,
+        'format': 'html',
+    }
+    stages_run = 'video' not in reused or (transcript_inputs is not None and 'transcript' not in reused)
+    if not stages_run and reusable('report', report_inputs, html_file):
+        reused.append('report')
+    else:
+        # Generate the HTML overview table
+        print("Generating HTML overview table...")
+        write_reports(events, {'html': html_file}, os.path.join(output_dir, base_name), transcript_data,
+                      interval_minutes=args.report_interval, all_transcripts=args.all_transcripts)
+        cache.record('report', report_inputs, html_file)
+
+    if reused:
+        print(f"Reused the unchanged stages: {', '.join(reused)}. Use --force to run them again.")
     print(f"HTML overview table generated at: {html_file}")
 
 
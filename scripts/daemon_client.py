@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import socket
+import struct
+import tempfile
+
+# Client side of matcher_daemon.py. Only the standard library is imported, so that scripts asking a running daemon
+# start quickly.
+
+PROTOCOL_VERSION = 1
+# Request: version, type, flags, n, length of the search filter, length of the payload.
+# The UTF-8 search filter and the payload follow.
+REQUEST_HEADER = struct.Struct('!BBBHHI')
+# Largest n and search filter (in bytes) that fit their unsigned 16-bit fields of the request header
+MAX_N = 0xFFFF
+MAX_SEARCH_FILTER_BYTES = 0xFFFF
+# Response: status and length of the payload, followed by the payload, the JSON of the result or of the error message.
+# The matches carry the strings and room metadata of the index, which the client does not load, so they stay JSON.
+RESPONSE_HEADER = struct.Struct('!BI')
+# Payload: an encoded image file (PNG, JPEG, ...), the result is the list of its top n matches
+MATCH_IMAGE = 1
+# Payload: packed hashes of hash_bytes bytes each, the result is a list of top n matches per hash
+MATCH_HASHES = 2
+# No payload, the result is the index info of the daemon's matcher
+INFO = 3
+FLAG_GROUP_BY_ROOM = 1
+STATUS_OK = 0
+STATUS_INVALID_IMAGE = 1
+STATUS_ERROR = 2
+MAX_PAYLOAD_BYTES = 64 * 1024 * 1024
+
+
+def default_socket_path(base_dir):
+    """The socket of the daemon serving base_dir, so that scripts find it from the base directory alone."""
+    digest = hashlib.sha1(os.path.abspath(base_dir).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), f"rwl-matcher-{digest}.sock")
+
+
+def read_exactly(stream, size):
+    """Reads size bytes, or returns None if the connection is closed before."""
+    data = stream.read(size) if size else b''
+    if len(data) < size:
+        return None
+    return data
+
+
+class DaemonError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class DaemonClient:
+    """A connection to a running matcher daemon, used for any number of requests."""
+
+    def __init__(self, connection, socket_path):
+        self.connection = connection
+        self.socket_path = socket_path
+        self.stream = connection.makefile('rb')
+
+    @classmethod
+    def connect(cls, base_dir, socket_path=None, timeout=30.0):
+        """A client of the daemon serving base_dir, or None if no daemon is running (or Unix sockets are missing)."""
+        if not hasattr(socket, 'AF_UNIX'):
+            return None
+        socket_path = socket_path or default_socket_path(base_dir)
+        if not os.path.exists(socket_path):
+            return None
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(timeout)
+        try:
+            connection.connect(socket_path)
+        except OSError:
+            # A socket file left behind by a daemon that did not stop cleanly
+            connection.close()
+            return None
+        return cls(connection, socket_path)
+
+    def request(self, message_type, payload=b'', n=1, group_by_room=False, search_filter=None):
+        search_filter = (search_filter or '').encode('utf-8')
+        if not 1 <= n <= MAX_N:
+            raise ValueError(f"n must be between 1 and {MAX_N}, got {n}")
+        if len(search_filter) > MAX_SEARCH_FILTER_BYTES:
+            raise ValueError(f"The search filter must be at most {MAX_SEARCH_FILTER_BYTES} bytes long, "
+                             f"got {len(search_filter)}")
+        if len(payload) > MAX_PAYLOAD_BYTES:
+            raise ValueError(f"The payload must be at most {MAX_PAYLOAD_BYTES} bytes long, got {len(payload)}")
+        flags = FLAG_GROUP_BY_ROOM if group_by_room else 0
+        header = REQUEST_HEADER.pack(PROTOCOL_VERSION, message_type, flags, n, len(search_filter), len(payload))
+        self.connection.sendall(header + search_filter + payload)
+        response_header = read_exactly(self.stream, RESPONSE_HEADER.size)
+        if response_header is None:
+            raise ConnectionError("The matcher daemon closed the connection")
+        status, length = RESPONSE_HEADER.unpack(response_header)
+        response = read_exactly(self.stream, length)
+        if response is None:
+            raise ConnectionError("The matcher daemon closed the connection")
+        result = json.loads(response)
+        if status != STATUS_OK:
+            raise DaemonError(status, result['error'])
+        return result
+
+    def match_image_file(self, image_data, n=1, group_by_room=False, search_filter=None):
+        return self.request(MATCH_IMAGE, image_data, n, group_by_room, search_filter)
+
+    def match_hashes(self, packed_hashes, n=1, group_by_room=False, search_filter=None):
+        return self.request(MATCH_HASHES, packed_hashes, n, group_by_room, search_filter)
+
+    def info(self):
+        return self.request(INFO)
+
+    def close(self):
+        self.stream.close()
+        self.connection.close()
@@ -0,0 +1,40 @@
+import numpy as np
+from daemon_client import DaemonClient
+from image_matcher import ImageMatcher
+from stage_profiler import NULL_PROFILER
+
+
+class DaemonMatcher(ImageMatcher):
+    """
+    An ImageMatcher that hashes the images in this process and leaves the search to a running matcher daemon, so that
+    the index does not have to be loaded. The daemon applies the search filter to its own index.
+    """
+
+    def __init__(self, client, search_filter=None, profiler=None):
+        self.client = client
+        self.search_filter = search_filter
+        self.hash_size = 8
+        self.hash_bytes = (self.hash_size * self.hash_size + 7) // 8
+        self.profiler = profiler or NULL_PROFILER
+
+    @classmethod
+    def connect(cls, base_dir, search_filter=None, profiler=None, socket_path=None):
+        """A matcher using the daemon serving base_dir, or None if no daemon is running."""
+        client = DaemonClient.connect(base_dir, socket_path)
+        return cls(client, search_filter, profiler) if client is not None else None
+
+    def subset(self, search_filter):
+        return DaemonMatcher(self.client, search_filter, self.profiler)
+
+    def match_image(self, image):
+        matches = self.match_images_top_n([image], 1)[0]
+        return matches[0] if matches else None
+
+    def match_hashes_top_n(self, packed_hashes, n=1, group_by_room=False):
+        with self.profiler.stage('search'):
+            self.profiler.count('queries', len(packed_hashes))
+            return self.client.match_hashes(np.ascontiguousarray(packed_hashes, dtype=np.uint8).tobytes(), n,
+                                            group_by_room, self.search_filter)
+
+    def index_info(self):
+        return self.client.info()
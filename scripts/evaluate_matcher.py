@@ -0,0 +1,150 @@
+import argparse
+import json
+import os
+import time
+import cv2
+import numpy as np
+from image_matcher import ImageMatcher
+
+# Fields of a label that have to match a result for it to be counted as correct, if they are present in the label
+LABEL_FIELDS = ('slugcat', 'region', 'room_key')
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Compare the accuracy and speed of ImageMatcher configurations on '
+                                                 'a set of labelled frames.')
+    parser.add_argument('labels_file', help='JSON list of frames with "path" (relative to the file) and "room_key", '
+                                            'optionally "slugcat" and "region".')
+    parser.add_argument('base_dir', help='Base directory containing images.')
+    parser.add_argument('--configs', help='JSON file with a list of configurations: {"name": ..., "matcher": '
+                                          '{ImageMatcher arguments}, "match": {match_image_top_n arguments}}.')
+    parser.add_argument('--top_k', type=int, default=5, help='k of the top-k accuracy.')
+    parser.add_argument('--depth', type=int, default=32,
+                        help='Number of matches requested per frame to find the best other room for the margin.')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of times the frames are matched for the speed.')
+    parser.add_argument('--output', help='Also write the results to this JSON file.')
+    return parser.parse_args()
+
+
+def load_labels(labels_file):
+    """The labels together with the frames, frames that cannot be read are skipped."""
+    with open(labels_file, 'r') as f:
+        labels = json.load(f)
+    frames_dir = os.path.dirname(os.path.abspath(labels_file))
+    frames = []
+    for label in labels:
+        path = os.path.join(frames_dir, label['path'])
+        image = cv2.imread(path)
+        if image is None:
+            print(f"Warning: Unable to read frame {path}")
+            continue
+        frames.append((label, image))
+    return frames
+
+
+def is_correct(match, label):
+    return all(match[field] == label[field] for field in LABEL_FIELDS if field in label)
+
+
+def same_room(match, other):
+    return all(match[field] == other[field] for field in LABEL_FIELDS)
+
+
+def evaluate(config, base_dir, frames, top_k, depth, repeat):
+    started = time.perf_counter()
+    matcher = ImageMatcher(base_dir, **config.get('matcher', {}))
+    load_time = time.perf_counter() - started
+    match_arguments = config.get('match', {})
+    n = max(top_k, depth)
+
+    durations = []
+    for _ in range(repeat):
+        all_matches = []
+        started = time.perf_counter()
+        for label, image in frames:
+            all_matches.append(matcher.match_image_top_n(image, n, **match_arguments))
+        durations.append(time.perf_counter() - started)
+
+    top_1 = 0
+    top_k_hits = 0
+    margins = []
+    correct_margins = []
+    for (label, image), matches in zip(frames, all_matches):
+        if not matches:
+            continue
+        best = matches[0]
+        top_1 += is_correct(best, label)
+        top_k_hits += any(is_correct(match, label) for match in matches[:top_k])
+        # Distance from the best match to the best match of any other room, None if there is none within depth
+        other = next((match for match in matches[1:] if not same_room(match, best)), None)
+        if other is not None:
+            margins.append(other['distance'] - best['distance'])
+            if is_correct(best, label):
+                correct_margins.append(margins[-1])
+
+    fastest = min(durations)
+    return {
+        'name': config.get('name', 'default'),
+        'matcher': config.get('matcher', {}),
+        'match': match_arguments,
+        'frames': len(frames),
+        'entries': int(len(matcher.hash_matrix)),
+        'load_time_s': round(load_time, 4),
+        'top_1_accuracy': round(top_1 / len(frames), 4) if frames else None,
+        f'top_{top_k}_accuracy': round(top_k_hits / len(frames), 4) if frames else None,
+        'mean_margin': round(float(np.mean(margins)), 3) if margins else None,
+        'median_margin': float(np.median(margins)) if margins else None,
+        'mean_margin_when_correct': round(float(np.mean(correct_margins)), 3) if correct_margins else None,
+        'ambiguous': sum(margin == 0 for margin in margins),
+        'queries_per_second': round(len(frames) / fastest, 1) if fastest > 0 else None,
+    }
+
+
+def pareto_frontier(results):
+    """Names of the configurations that no other configuration beats in top-1 accuracy and speed at the same time."""
+    frontier = []
+    for result in results:
+        dominated = any(
+            other['top_1_accuracy'] >= result['top_1_accuracy'] and
+            other['queries_per_second'] >= result['queries_per_second'] and
+            (other['top_1_accuracy'] > result['top_1_accuracy'] or
+             other['queries_per_second'] > result['queries_per_second'])
+            for other in results)
+        if not dominated:
+            frontier.append(result['name'])
+    return frontier
+
+
+def main():
+    args = parse_arguments()
+    configs = [{'name': 'default'}]
+    if args.configs:
+        with open(args.configs, 'r') as f:
+            configs = json.load(f)
+
+    frames = load_labels(args.labels_file)
+    if not frames:
+        print("Error: No labelled frames could be read.")
+        return
+    print(f"Evaluating {len(configs)} configurations on {len(frames)} frames")
+
+    results = [evaluate(config, args.base_dir, frames, args.top_k, args.depth, args.repeat) for config in configs]
+    frontier = pareto_frontier(results)
+
+    print(f"{'configuration':<24} {'top-1':>7} {f'top-{args.top_k}':>7} {'margin':>7} {'ambiguous':>9} "
+          f"{'queries/s':>10}")
+    for result in results:
+        mean_margin = result['mean_margin'] if result['mean_margin'] is not None else float('nan')
+        print(f"{result['name']:<24} {result['top_1_accuracy']:>7.1%} {result[f'top_{args.top_k}_accuracy']:>7.1%} "
+              f"{mean_margin:>7.2f} {result['ambiguous']:>9} {result['queries_per_second']:>10.1f}"
+              f"{'  *' if result['name'] in frontier else ''}")
+    print("* on the Pareto frontier of top-1 accuracy and queries per second")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'results': results, 'pareto_frontier': frontier}, f, indent=2)
+        print(f"Results saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
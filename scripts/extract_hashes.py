@@ -3,14 +3,20 @@ import cv2
 import argparse
 import pickle
 import json
+from thumbnails import THUMBNAIL_DIR, thumbnail_filename
 
 
-def parse_arguments():
+def parse_arguments(argv=None):
     parser = argparse.ArgumentParser(description='Extract image hashes and metadata from images.')
     parser.add_argument('base_dir', help='Base directory containing images.')
     parser.add_argument('--search_filter',
                         help='Comma-separated list of slugcat/region pairs or slugcat names to filter the extraction.')
-    return parser.parse_args()
+    parser.add_argument('--thumbnails', action='store_true',
+                        help='Also store small preview images of the screenshots next to the hashes.')
+    parser.add_argument('--thumbnail_width', type=int, default=320, help='Width of the thumbnails in pixels.')
+    parser.add_argument('--thumbnail_format', choices=['webp', 'jpg'], default='webp', help='Format of the thumbnails.')
+    parser.add_argument('--thumbnail_quality', type=int, default=80, help='Quality of the thumbnails from 0 to 100.')
+    return parser.parse_args(argv)
 
 
 def is_image_file(filename):
@@ -30,10 +36,22 @@ def average_hash(image, hash_size=8):
     return hash_bits.flatten()
 
 
-def main():
-    args = parse_arguments()
-    base_dir = args.base_dir
-    search_filter = args.search_filter
+def write_thumbnail(image, thumbnail_path, width, thumbnail_format, quality):
+    height, original_width = image.shape[:2]
+    if original_width > width:
+        image = cv2.resize(image, (width, max(1, round(height * width / original_width))), interpolation=cv2.INTER_AREA)
+    if thumbnail_format == 'webp':
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+    else:
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    if not cv2.imwrite(thumbnail_path, image, params):
+        print(f"Warning: Unable to write thumbnail {thumbnail_path}")
+
+
+def extract_hashes(base_dir, search_filter=None, thumbnails=False, thumbnail_width=320, thumbnail_format='webp',
+                   thumbnail_quality=80, verbose=True):
+    """Writes a hashes.pkl file into every region directory below base_dir and returns the paths of the files."""
+    hashes_file_paths = []
 
     # Parse search_filter into a list of (slugcat, region) tuples
     filters = []
@@ -82,7 +100,8 @@ def main():
                 if not include_region:
                     continue
 
-            print(f"Processing region: {slugcat}/{region}")
+            if verbose:
+                print(f"Processing region: {slugcat}/{region}")
             hashes = []
 
             # Read metadata.json
@@ -102,6 +121,10 @@ def main():
             # Prepare room keys for matching
             room_keys = {room_key.lower(): room_data for room_key, room_data in rooms.items()}
 
+            thumbnails_path = os.path.join(region_path, THUMBNAIL_DIR)
+            if thumbnails:
+                os.makedirs(thumbnails_path, exist_ok=True)
+
             # Process images in region directory
             for filename in os.listdir(region_path):
                 if is_image_file(filename):
@@ -133,6 +156,11 @@ def main():
                     # Compute average hash
                     hash_value = average_hash(image)
 
+                    if thumbnails:
+                        thumbnail_path = os.path.join(thumbnails_path,
+                                                      thumbnail_filename(filename, thumbnail_format))
+                        write_thumbnail(image, thumbnail_path, thumbnail_width, thumbnail_format, thumbnail_quality)
+
                     # Remove 'tiles' and 'nodes' from room metadata if present
                     matched_room_data.pop('tiles', None)
                     matched_room_data.pop('nodes', None)
@@ -150,8 +178,18 @@ def main():
             hashes_file_path = os.path.join(region_path, 'hashes.pkl')
             with open(hashes_file_path, 'wb') as f:
                 pickle.dump(hashes, f)
+            hashes_file_paths.append(hashes_file_path)
+
+            if verbose:
+                print(f"Hash extraction complete for [{slugcat}/{region}]: {hashes_file_path}")
+
+    return hashes_file_paths
+
 
-            print(f"Hash extraction complete for [{slugcat}/{region}]: {hashes_file_path}")
+def main(argv=None):
+    args = parse_arguments(argv)
+    extract_hashes(args.base_dir, args.search_filter, args.thumbnails, args.thumbnail_width, args.thumbnail_format,
+                   args.thumbnail_quality)
 
 
 if __name__ == '__main__':
@@ -1,81 +1,58 @@
-from flask import Flask, request, render_template, jsonify
 import argparse
-import os
-import cv2
-import numpy as np
-import base64
-from image_matcher import ImageMatcher
-from collections import Counter
 
-app = Flask(__name__)
 
-image_matcher = None
-ABSOLUTE_PATH = None
-
-
-@app.route('/')
-def index():
-    return render_template('index.html')
-
-
-@app.route('/upload_image', methods=['POST'])
-def upload_image():
-    global image_matcher, ABSOLUTE_PATH
-
-    data = request.json.get('image')
-    n = int(request.json.get('n', 1))
-
-    if not data:
-        return jsonify({'error': 'No image data received'}), 400
-
-    # Decode the base64 image
-    header, encoded = data.split(',', 1)
-    image_data = base64.b64decode(encoded)
-    np_arr = np.frombuffer(image_data, np.uint8)
-    image = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-
-    if image is None:
-        return jsonify({'error': 'Invalid image data'}), 400
-
-    # Get top N matches
-    matches = image_matcher.match_image_top_n(image, n)
-
-    if not matches:
-        return jsonify({'error': 'No matches found'}), 200
-
-    response_data = []
-
-    for match in matches:
-        filename = match['filename']
-        full_path = 'http://localhost:8000/' + match['slugcat'] + '/' + match['region'] + '/' + filename
-        response_data.append({
-            'slugcat': match['slugcat'],
-            'region': match['region'],
-            'filename': filename,
-            'room_key': match['room_key'],
-            'distance': match['distance'],
-            'image_path': full_path
-        })
-
-    return jsonify({'matches': response_data}), 200
-
-@app.route('/get_base_path', methods=['GET'])
-def get_base_path():
-    global ABSOLUTE_PATH
-    return jsonify({'base_path': ABSOLUTE_PATH})
-
-def parse_arguments():
+def parse_arguments(argv=None):
     parser = argparse.ArgumentParser(description='Run the Flask image matcher server.')
     parser.add_argument('base_dir', help='Base directory containing images.')
     parser.add_argument('--search_filter',
                         help='Comma-separated list of slugcat/region pairs or slugcat names to filter the search.')
     parser.add_argument('--host', default='0.0.0.0', help='Host to run the server.')
     parser.add_argument('--port', type=int, default=5000, help='Port to run the server.')
-    return parser.parse_args()
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes sharing the loaded index. Default is 1.')
+    parser.add_argument('--batch_window_ms', type=float, default=2.0,
+                        help='Window in milliseconds in which overlapping queries are collected and matched '
+                             'together. A query arriving alone is matched at once. 0 disables batching. Default is 2.')
+    parser.add_argument('--max_batch_size', type=int, default=32,
+                        help='Maximum number of queries matched together, at least 1. Default is 32.')
+    parser.add_argument('--cache_size', type=int, default=1024,
+                        help='Maximum number of cached match results and upload hashes. 0 disables caching. '
+                             'Default is 1024.')
+    parser.add_argument('--watch_interval', type=float, default=0,
+                        help='Check the hash files for changes every x seconds and reload the index when they '
+                             'changed. 0 disables watching. Default is 0.')
+    parser.add_argument('--job_workers', type=int, default=0,
+                        help='Number of video analysis jobs run at the same time. 0 disables the job API. '
+                             'Only available with a single worker process. Default is 0.')
+    parser.add_argument('--max_queued_jobs', type=int, default=4,
+                        help='Maximum number of video analysis jobs waiting for a free job worker. Default is 4.')
+    parser.add_argument('--no_metrics', action='store_true', help='Disable the /metrics endpoint.')
+    parser.add_argument('--shards', type=int, default=0,
+                        help='Split the index into this many row ranges, each searched by its own process. '
+                             'Only available with a single worker process. 0 searches in the server process. '
+                             'Default is 0.')
+    parser.add_argument('--lazy', action='store_true',
+                        help='Only list the hash files at startup and load each slugcat/region the first time a query '
+                             'searches it.')
+    parser.add_argument('--memory_budget_mb', type=float,
+                        help='With --lazy, drop the least recently searched regions when the loaded ones exceed this '
+                             'many megabytes. Default is no limit.')
+    parser.add_argument('--compact_distance', type=int,
+                        help='Merge screenshots whose hashes differ in at most this many bits into one searched '
+                             'representative. Results stay the same, 0 only merges identical hashes. '
+                             'Default is no compaction.')
+    args = parser.parse_args(argv)
+    if args.max_batch_size < 1:
+        parser.error('--max_batch_size must be at least 1')
+    return args
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    # Flask, OpenCV and the matchers are only imported once the arguments are parsed, so --help answers quickly
+    import server_app
+    server_app.run(args)
 
 
 if __name__ == '__main__':
-    args = parse_arguments()
-    ABSOLUTE_PATH = os.path.abspath(args.base_dir)
-    image_matcher = ImageMatcher(ABSOLUTE_PATH, search_filter=args.search_filter or None)
-    app.run(host=args.host, port=args.port)
+    main()
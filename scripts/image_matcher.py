@@ -1,16 +1,61 @@
+import copy
+import json
 import os
 import pickle
+import sys
+import time
+from collections import defaultdict
 import cv2
 import numpy as np
+from stage_profiler import NULL_PROFILER
+
+# Number of set bits for every byte value, used to count differing bits between packed hashes
+POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+# Upper bound for the temporary query x dataset x bytes array built while computing distances
+MAX_DISTANCE_CHUNK_BYTES = 64 * 1024 * 1024
+
+
+def intern_code(pool, codes, value):
+    """Code of the value in the pool (a list of distinct values), appending the value if it is new."""
+    code = codes.get(value)
+    if code is None:
+        code = codes[value] = len(pool)
+        pool.append(value)
+    return code
+
+
+def object_size(value, seen):
+    """Bytes of a value with everything it contains, like the metadata dicts, counting shared objects once."""
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(object_size(key, seen) + object_size(item, seen) for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(object_size(item, seen) for item in value)
+    return size
 
 
 class ImageMatcher:
-    def __init__(self, base_dir, search_filter=None):
+    def __init__(self, base_dir, search_filter=None, profiler=None, compact_distance=None):
         self.base_dir = base_dir
         self.search_filter = search_filter
         self.hash_size = 8
+        self.hash_bytes = (self.hash_size * self.hash_size + 7) // 8
+        # Screenshots whose hashes differ in at most this many bits share one row of the searched matrix, see compact
+        self.compact_distance = compact_distance
+        self.representative_matrix = None
+        # Receives the durations of the 'load', 'hash' and 'search' stages, see stage_profiler.py
+        self.profiler = profiler or NULL_PROFILER
         self.filters = self.parse_search_filter(search_filter)
-        self.hashes = self.load_hashes()
+        load_started = time.perf_counter()
+        with self.profiler.stage('load'):
+            # Taken before loading, so that files changing during the load are detected as changed afterward
+            self.signature = self.index_signature()
+            self.load_index()
+        self.load_duration = time.perf_counter() - load_started
+        self.loaded_at = time.time()
 
     def parse_search_filter(self, search_filter):
         filters = []
@@ -39,75 +84,317 @@ class ImageMatcher:
     def hamming_distance(self, hash1, hash2):
         return np.count_nonzero(hash1 != hash2)
 
-    def load_hashes(self):
-        hashes = []
+    def pack_hashes(self, hashes):
+        # One row of packed bytes per hash, so that distances can be computed for the whole dataset at once
+        if len(hashes) == 0:
+            return np.zeros((0, self.hash_bytes), dtype=np.uint8)
+        return np.packbits(np.asarray(hashes, dtype=bool), axis=1)
+
+    def hash_images(self, images):
+        with self.profiler.stage('hash'):
+            return self.pack_hashes([self.average_hash(image) for image in images])
+
+    def hamming_distances(self, packed_hashes, hash_matrix=None):
+        """Distances from every packed query hash to every dataset hash, as a queries x dataset matrix."""
+        hash_matrix = self.hash_matrix if hash_matrix is None else hash_matrix
+        distances = np.empty((len(packed_hashes), len(hash_matrix)), dtype=np.int32)
+        row_bytes = max(hash_matrix.size, 1)
+        chunk_size = max(1, MAX_DISTANCE_CHUNK_BYTES // row_bytes)
+        for start in range(0, len(packed_hashes), chunk_size):
+            chunk = packed_hashes[start:start + chunk_size]
+            differing_bits = np.bitwise_xor(chunk[:, None, :], hash_matrix[None, :, :])
+            distances[start:start + chunk_size] = POPCOUNT_TABLE[differing_bits].sum(axis=2)
+        return distances
+
+    def compact(self, max_distance):
+        """
+        Clusters the hashes so that every hash is at most max_distance bits away from the representative of its
+        cluster, and stores the representatives with a posting list of their rows, so that the search can scan the
+        representatives instead of every screenshot. Identical hashes are merged first, then representatives are
+        picked greedily. Candidates for a cluster are found with max_distance + 1 bit ranges of the hash: two hashes
+        within max_distance bits are identical in at least one of them.
+        """
+        unique_hashes, row_hashes = np.unique(self.hash_matrix, axis=0, return_inverse=True)
+        row_hashes = row_hashes.reshape(-1)
+        leaders = np.arange(len(unique_hashes))
+        if max_distance > 0 and len(unique_hashes):
+            bits = np.unpackbits(unique_hashes, axis=1).astype(np.int64)
+            chunks = np.array_split(np.arange(bits.shape[1]), max_distance + 1)
+            keys = [bits[:, chunk] @ (1 << np.arange(len(chunk), dtype=np.int64)) for chunk in chunks]
+            buckets = [defaultdict(list) for _ in chunks]
+            for chunk_keys, chunk_buckets in zip(keys, buckets):
+                for index, key in enumerate(chunk_keys.tolist()):
+                    chunk_buckets[key].append(index)
+            leaders[:] = -1
+            for index in range(len(unique_hashes)):
+                if leaders[index] >= 0:
+                    continue
+                leaders[index] = index
+                candidates = np.unique(np.concatenate([chunk_buckets[chunk_keys[index]]
+                                                       for chunk_keys, chunk_buckets in zip(keys, buckets)]))
+                candidates = candidates[leaders[candidates] < 0]
+                if len(candidates):
+                    distances = POPCOUNT_TABLE[np.bitwise_xor(unique_hashes[candidates], unique_hashes[index])].sum(1)
+                    leaders[candidates[distances <= max_distance]] = index
+
+        representatives, row_representatives = np.unique(leaders[row_hashes], return_inverse=True)
+        self.representative_matrix = unique_hashes[representatives]
+        self.set_postings(row_representatives.reshape(-1), len(representatives))
+
+    def set_postings(self, row_representatives, representative_count):
+        """Builds the posting lists (ascending rows per representative) from the representative of every row."""
+        self.posting_rows = np.argsort(row_representatives, kind='stable').astype(np.int32)
+        counts = np.bincount(row_representatives, minlength=representative_count)
+        self.posting_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    def expand_postings(self, representatives):
+        """Rows of the given representatives in ascending order."""
+        starts = self.posting_offsets[representatives]
+        lengths = self.posting_offsets[representatives + 1] - starts
+        positions = np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return np.sort(self.posting_rows[positions])
+
+    def compacted_candidates(self, packed_hash, representative_distances, n, group_by_room):
+        """
+        Rows and exact distances that contain the top n matches of the query, found from the distances to the
+        representatives. Every row is at most compact_distance bits further from the query than its representative,
+        and at most that much closer, so expanding the representatives up to a cutoff + 2 * compact_distance yields
+        every row up to cutoff + compact_distance. The results are therefore the same as without compaction.
+        """
+        slack = self.compact_distance
+        max_distance = self.hash_matrix.shape[1] * 8
+        counts = np.diff(self.posting_offsets)
+        # Smallest representative distance up to which the postings hold n rows
+        rows_within = np.cumsum(np.bincount(representative_distances, weights=counts, minlength=max_distance + 1))
+        cutoff = int(np.searchsorted(rows_within, n))
+        while True:
+            complete = cutoff + slack
+            if complete + slack >= max_distance:
+                complete = max_distance
+            rows = self.expand_postings(np.flatnonzero(representative_distances <= complete + slack))
+            distances = POPCOUNT_TABLE[np.bitwise_xor(self.hash_matrix[rows], packed_hash)].sum(axis=1, dtype=np.int32)
+            within = distances <= complete
+            rows, distances = rows[within], distances[within]
+            # Without grouping, the postings up to the cutoff already hold n rows, grouping may need more
+            if not group_by_room or complete == max_distance or \
+                    len(np.unique(self.room_ids[rows])) >= n:
+                return rows, distances
+            cutoff = complete + slack + 1
+
+    @staticmethod
+    def top_n_rows(distances, n):
+        """Rows of the n smallest distances in ascending order, equal distances in dataset order like a stable sort."""
+        if n < 1:
+            return np.zeros(0, dtype=np.int64)
+        if n < len(distances):
+            # Partial selection finds the n-th smallest distance, so only the rows up to it have to be sorted
+            kth_distance = np.partition(distances, n - 1)[n - 1]
+            candidates = np.flatnonzero(distances <= kth_distance)
+        else:
+            candidates = np.arange(len(distances))
+        return candidates[np.argsort(distances[candidates], kind='stable')[:n]]
+
+    def best_row_per_room(self, distances, room_ids=None):
+        """The row with the smallest distance of every room (the first one on ties), in dataset order."""
+        room_ids = self.room_ids if room_ids is None else room_ids
+        best_distances = np.full(len(self.room_slugcats), np.iinfo(np.int32).max, dtype=distances.dtype)
+        np.minimum.at(best_distances, room_ids, distances)
+        rows = np.flatnonzero(distances == best_distances[room_ids])
+        _, first = np.unique(room_ids[rows], return_index=True)
+        return np.sort(rows[first])
+
+    def build_match(self, index, distance):
+        room_id = self.room_ids[index]
+        return {
+            'slugcat': self.slugcat_names[self.room_slugcats[room_id]],
+            'region': self.region_names[self.room_regions[room_id]],
+            'filename': self.filenames[self.filename_codes[index]],
+            'room_key': self.room_keys[room_id],
+            'room_metadata': self.room_metadata[room_id],
+            'distance': int(distance)
+        }
+
+    def includes(self, slugcat, region=None):
+        """Whether the search filter includes the slugcat/region pair, or any region of the slugcat if none is given."""
+        if self.filters is None:
+            return True
+        return any(
+            f_slugcat == slugcat and (region is None or f_region is None or f_region == region)
+            for f_slugcat, f_region in self.filters
+        )
+
+    def iter_hash_files(self):
+        """Yields (slugcat, region, path) for every hashes.pkl file included by the search filter."""
         for slugcat in os.listdir(self.base_dir):
             slugcat_path = os.path.join(self.base_dir, slugcat)
-            if not os.path.isdir(slugcat_path):
+            if not os.path.isdir(slugcat_path) or not self.includes(slugcat):
                 continue
-            if self.filters is not None:
-                include_slugcat = any(
-                    (f_slugcat == slugcat and f_region is None) for f_slugcat, f_region in self.filters
-                )
-                include_slugcat_with_region = any(
-                    (f_slugcat == slugcat and f_region is not None) for f_slugcat, f_region in self.filters
-                )
-                if not include_slugcat and not include_slugcat_with_region:
-                    continue
             for region in os.listdir(slugcat_path):
                 region_path = os.path.join(slugcat_path, region)
-                if not os.path.isdir(region_path):
+                if not os.path.isdir(region_path) or not self.includes(slugcat, region):
                     continue
-                if self.filters is not None:
-                    include_region = any(
-                        (f_slugcat == slugcat and (f_region == region or f_region is None))
-                        for f_slugcat, f_region in self.filters
-                    )
-                    if not include_region:
-                        continue
                 hashes_file_path = os.path.join(region_path, 'hashes.pkl')
                 if not os.path.isfile(hashes_file_path):
                     continue
-                with open(hashes_file_path, 'rb') as f:
-                    region_hashes = pickle.load(f)
-                    for hash_entry in region_hashes:
-                        hash_entry['slugcat'] = slugcat
-                        hash_entry['region'] = region
-                        hashes.append(hash_entry)
-        return hashes
+                yield slugcat, region, hashes_file_path
+
+    def index_signature(self):
+        """Paths, modification times and sizes of the included hash files, to detect a re-extracted index."""
+        signature = []
+        for slugcat, region, hashes_file_path in self.iter_hash_files():
+            stat = os.stat(hashes_file_path)
+            signature.append((hashes_file_path, stat.st_mtime_ns, stat.st_size))
+        return signature
+
+    def load_index(self):
+        self.load_hashes()
+        if self.compact_distance is not None:
+            self.compact(self.compact_distance)
+
+    def load_hashes(self):
+        """
+        Loads the included hash files into columns instead of one dict per screenshot: the packed hashes, and for every
+        entry the number of its room and of its filename. The rooms table holds the room key, slugcat, region and
+        metadata of every slugcat/region/room. Strings are kept once in pools and identical metadata only once,
+        shared by all cameras of a room and by all slugcats with the same room. Match dicts are built from these
+        columns when they are requested, see build_match.
+        """
+        slugcat_codes, region_codes, filename_codes = {}, {}, {}
+        # Canonical JSON of the metadata -> the one dict kept for it
+        metadata_by_content = {}
+        self.slugcat_names, self.region_names, self.filenames = [], [], []
+        self.room_keys, self.room_metadata = [], []
+        room_slugcats, room_regions, room_ids, entry_filenames, packed_hashes = [], [], [], [], []
+        for slugcat, region, hashes_file_path in self.iter_hash_files():
+            with open(hashes_file_path, 'rb') as f:
+                region_hashes = pickle.load(f)
+            if not region_hashes:
+                continue
+            slugcat_code = intern_code(self.slugcat_names, slugcat_codes, slugcat)
+            region_code = intern_code(self.region_names, region_codes, region)
+            file_rooms = {}
+            for hash_entry in region_hashes:
+                room_id = file_rooms.get(hash_entry['room_key'])
+                if room_id is None:
+                    room_id = file_rooms[hash_entry['room_key']] = len(self.room_keys)
+                    content = json.dumps(hash_entry['room_metadata'], sort_keys=True, default=str)
+                    self.room_keys.append(sys.intern(hash_entry['room_key']))
+                    self.room_metadata.append(metadata_by_content.setdefault(content, hash_entry['room_metadata']))
+                    room_slugcats.append(slugcat_code)
+                    room_regions.append(region_code)
+                room_ids.append(room_id)
+                entry_filenames.append(intern_code(self.filenames, filename_codes, hash_entry['filename']))
+            packed_hashes.append(self.pack_hashes([hash_entry['hash'] for hash_entry in region_hashes]))
+
+        self.room_slugcats = np.array(room_slugcats, dtype=np.int32)
+        self.room_regions = np.array(room_regions, dtype=np.int32)
+        self.room_ids = np.array(room_ids, dtype=np.int32)
+        self.filename_codes = np.array(entry_filenames, dtype=np.int32)
+        self.hash_matrix = np.concatenate(packed_hashes) if packed_hashes else self.pack_hashes([])
+
+    def subset(self, search_filter):
+        """
+        A matcher over the part of the already loaded index that is included by the search filter,
+        sharing its entries instead of loading them again.
+        """
+        subset = copy.copy(self)
+        subset.search_filter = search_filter
+        subset.filters = self.parse_search_filter(search_filter)
+        # The pools and the rooms table are shared, only the rows of the excluded rooms are dropped
+        included_rooms = np.array([subset.includes(self.slugcat_names[slugcat_code], self.region_names[region_code])
+                                   for slugcat_code, region_code in zip(self.room_slugcats, self.room_regions)],
+                                  dtype=bool)
+        rows = np.flatnonzero(included_rooms[self.room_ids]) if len(self.room_ids) else self.room_ids
+        subset.select_rows(rows)
+        return subset
+
+    def select_rows(self, rows):
+        """Keeps only the given rows (ascending) of the index, used by subset and by the shards of ShardedMatcher."""
+        if self.representative_matrix is not None:
+            # Postings of the dropped rows are removed, and representatives without any kept row with them
+            row_representatives = np.empty(len(self.hash_matrix), dtype=np.int64)
+            row_representatives[self.posting_rows] = np.repeat(np.arange(len(self.representative_matrix)),
+                                                               np.diff(self.posting_offsets))
+            kept_representatives, subset_row_representatives = np.unique(row_representatives[rows],
+                                                                          return_inverse=True)
+            self.representative_matrix = self.representative_matrix[kept_representatives]
+            self.set_postings(subset_row_representatives.reshape(-1), len(kept_representatives))
+        self.hash_matrix = self.hash_matrix[rows]
+        self.room_ids = self.room_ids[rows]
+        self.filename_codes = self.filename_codes[rows]
 
     def match_image(self, image):
-        input_hash = self.average_hash(image)
-        best_match = None
-        best_distance = np.inf
-        for hash_entry in self.hashes:
-            dataset_hash = hash_entry['hash']
-            distance = self.hamming_distance(input_hash, dataset_hash)
-            if distance < best_distance:
-                best_distance = distance
-                best_match = {
-                    'slugcat': hash_entry['slugcat'],
-                    'region': hash_entry['region'],
-                    'filename': hash_entry['filename'],
-                    'room_key': hash_entry['room_key'],
-                    'room_metadata': hash_entry['room_metadata'],
-                    'distance': distance
-                }
-        return best_match
-
-    def match_image_top_n(self, image, n=1):
-        input_hash = self.average_hash(image)
-        matches = []
-        for hash_entry in self.hashes:
-            dataset_hash = hash_entry['hash']
-            distance = self.hamming_distance(input_hash, dataset_hash)
-            matches.append({
-                'slugcat': hash_entry['slugcat'],
-                'region': hash_entry['region'],
-                'filename': hash_entry['filename'],
-                'room_key': hash_entry['room_key'],
-                'room_metadata': hash_entry['room_metadata'],
-                'distance': distance
-            })
-        matches.sort(key=lambda x: x['distance'])
-        return matches[:n]
+        if not len(self.hash_matrix):
+            return None
+        packed_hashes = self.hash_images([image])
+        if self.representative_matrix is not None:
+            return self.match_hashes_top_n(packed_hashes, 1)[0][0]
+        with self.profiler.stage('search'):
+            self.profiler.count('queries')
+            distances = self.hamming_distances(packed_hashes)[0]
+            best_index = int(np.argmin(distances))
+            return self.build_match(best_index, distances[best_index])
+
+    def match_image_top_n(self, image, n=1, group_by_room=False):
+        return self.match_images_top_n([image], n, group_by_room)[0]
+
+    def match_images_top_n(self, images, n=1, group_by_room=False):
+        return self.match_hashes_top_n(self.hash_images(images), n, group_by_room)
+
+    def match_hashes_top_n(self, packed_hashes, n=1, group_by_room=False):
+        """
+        Top n matches for every packed query hash, computed with a single distance matrix.
+        With group_by_room, only the best screenshot of every room is returned, so that n different rooms are found
+        instead of several cameras of the same room. Match dicts are only built for the returned rows.
+        """
+        with self.profiler.stage('search'):
+            self.profiler.count('queries', len(packed_hashes))
+            return [[self.build_match(index, distance) for index, distance in zip(rows, distances)]
+                    for rows, distances in self.top_n_candidates(packed_hashes, n, group_by_room)]
+
+    def top_n_candidates(self, packed_hashes, n=1, group_by_room=False):
+        """The rows and distances of the top n matches of every packed query hash, in the order of the matches."""
+        results = []
+        if self.representative_matrix is not None:
+            representative_distances = self.hamming_distances(packed_hashes, self.representative_matrix)
+            for packed_hash, distances in zip(packed_hashes, representative_distances):
+                rows, distances = self.compacted_candidates(packed_hash, distances, n, group_by_room)
+                results.append(self.select_top_n(distances, n, group_by_room, rows))
+            return results
+        for distances in self.hamming_distances(packed_hashes):
+            results.append(self.select_top_n(distances, n, group_by_room))
+        return results
+
+    def select_top_n(self, distances, n, group_by_room, rows=None):
+        """Rows and distances of the top n of the distances, which belong to the given rows (ascending) or to all."""
+        room_ids = self.room_ids if rows is None else self.room_ids[rows]
+        if group_by_room:
+            positions = self.best_row_per_room(distances, room_ids)
+            positions = positions[self.top_n_rows(distances[positions], n)]
+        else:
+            positions = self.top_n_rows(distances, n)
+        return (positions if rows is None else rows[positions]), distances[positions]
+
+    def estimate_memory_bytes(self):
+        """Approximate memory taken by the loaded index: its columns, the string pools and the room metadata."""
+        arrays = [self.hash_matrix, self.room_ids, self.filename_codes, self.room_slugcats, self.room_regions]
+        if self.representative_matrix is not None:
+            arrays += [self.representative_matrix, self.posting_rows, self.posting_offsets]
+        seen = set()
+        return sum(array.nbytes for array in arrays) + sum(
+            object_size(pool, seen) for pool in (self.slugcat_names, self.region_names, self.filenames,
+                                                 self.room_keys, self.room_metadata))
+
+    def index_info(self):
+        info = {
+            'entries': len(self.hash_matrix),
+            'hash_files': len(self.signature),
+            'hash_matrix_bytes': int(self.hash_matrix.nbytes),
+            'load_duration_s': round(self.load_duration, 3),
+            'loaded_at': self.loaded_at,
+        }
+        if self.representative_matrix is not None:
+            info['compact_distance'] = self.compact_distance
+            info['representatives'] = len(self.representative_matrix)
+            info['compression_ratio'] = round(len(self.hash_matrix) / max(len(self.representative_matrix), 1), 3)
+        return info
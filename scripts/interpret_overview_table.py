@@ -1,24 +1,12 @@
 import json
-from datetime import timedelta
 import argparse
-from collections import defaultdict
 import os
-import markdown
+from collections import deque
+from interpret_csv import csv_rows, save_summaries_to_csv
+from location_aggregation import EventTable, format_seconds, summarize_intervals
+from thumbnails import preview_path
 
-
-def parse_timestamp(timestamp_str):
-    """Parse a timestamp string in 'hh:mm:ss' format into a timedelta object."""
-    h, m, s = map(int, timestamp_str.split(':'))
-    return timedelta(hours=h, minutes=m, seconds=s)
-
-
-def format_timedelta(td):
-    """Format a timedelta object as 'hh:mm:ss'."""
-    total_seconds = int(td.total_seconds())
-    hours = total_seconds // 3600
-    minutes = (total_seconds % 3600) // 60
-    seconds = total_seconds % 60
-    return f"{hours}:{minutes:02}:{seconds:02}"
+REPORT_FORMATS = ('md', 'html', 'csv')
 
 
 def extract_region_from_filename(filename):
@@ -28,115 +16,76 @@ def extract_region_from_filename(filename):
     return filename.split('_')[0]
 
 
-def summarize_locations(events, transcript_data=None, interval_minutes=5, subregion_limit=10):
-    """Summarize player's predominant location and rooms for each interval."""
+def align_transcript(intervals, batches, all_overlaps=False):
+    """
+    Transcript summaries of every interval, as lists of (summary, overlap in seconds), in one sweep over the intervals
+    and the batches sorted by start. By default, every batch is used once, for the first interval it overlaps, and an
+    interval takes at most the earliest unused batch overlapping it. With all_overlaps, an interval takes every
+    non-empty batch overlapping it, the batches overlapping it most first.
+    """
+    batches = sorted(batches, key=lambda batch: batch['start'])
+    aligned = []
+    next_batch = 0
+    # Batches starting before the end of the current interval, that were not used and may still overlap
+    pending = deque()
+    for interval in intervals:
+        while next_batch < len(batches) and batches[next_batch]['start'] < interval['end']:
+            pending.append(batches[next_batch])
+            next_batch += 1
+        if all_overlaps:
+            # Batches ending before this interval do not overlap the later intervals either
+            pending = deque(batch for batch in pending if batch['end'] > interval['start'])
+            overlaps = [(batch['summary'], min(batch['end'], interval['end']) - max(batch['start'], interval['start']))
+                        for batch in pending if batch['summary']]
+            aligned.append(sorted(overlaps, key=lambda overlap: overlap[1], reverse=True))
+            continue
+        while pending and pending[0]['end'] <= interval['start']:
+            pending.popleft()
+        if pending:
+            batch = pending.popleft()
+            overlap = min(batch['end'], interval['end']) - max(batch['start'], interval['start'])
+            aligned.append([(batch['summary'], overlap)])
+        else:
+            aligned.append([])
+    return aligned
+
+
+def overview_rows(intervals, transcript_data=None, all_transcripts=False):
+    """
+    Rows of the overview table, one per interval with events, with the transcript summaries of the interval, see
+    align_transcript.
+    """
     summaries = []
-    interval_seconds = interval_minutes * 60
-    events.sort(key=lambda x: parse_timestamp(x['timestamp']))
-
-    if not events:
-        return summaries
-
-    start_time = parse_timestamp(events[0]['timestamp'])
-    end_time = start_time + timedelta(seconds=interval_seconds)
-    area_counts = {}
-    room_counts = {}
-    slugcat_counts = {}
-    filename_map = defaultdict(set)
-    subregion_counts = {}
-
-    # Convert transcript data times to timedelta objects and keep track of used entries
-    if transcript_data and transcript_data['batches']:
-        for entry in transcript_data['batches']:
-            entry['start_td'] = timedelta(seconds=entry['start'])
-            entry['end_td'] = timedelta(seconds=entry['end'])
-        used_transcript_indices = set()
-
-    event_index = 0
-    total_events = len(events)
-
-    while event_index < total_events:
-        event = events[event_index]
-        event_time = parse_timestamp(event['timestamp'])
-
-        # Advance intervals if event_time is beyond the current end_time
-        if event_time >= end_time:
-            if area_counts:
-                # Determine predominant area, slugcat, and top rooms
-                predominant_area = max(area_counts, key=area_counts.get)
-                predominant_slugcat = max(slugcat_counts, key=slugcat_counts.get)
-                top_rooms = sorted(room_counts.items(), key=lambda x: x[1], reverse=True)[:4]
-                top_room_names = [room for room, count in top_rooms]
-                top_filenames = [
-                    {'name': filename,
-                     'path': f"./{predominant_slugcat}/{extract_region_from_filename(filename)}/{filename}"}
-                    for room in top_room_names
-                    for filename in filename_map[room]
-                ]
-                top_subregions = sorted(
-                    [(subregion, count) for subregion, count in subregion_counts.items() if count > 4],
-                    key=lambda x: x[1],
-                    reverse=True
-                )[:subregion_limit]
-                top_subregion_names = [subregion if subregion else 'none' for subregion, count in top_subregions]
-                top_subregion_names = [subregion for subregion in top_subregion_names if subregion != 'none']
-
-                # Find applicable transcript summaries
-                transcript_summaries = []
-                if transcript_data and transcript_data['batches']:
-                    interval_start = start_time
-                    interval_end = end_time
-                    for idx, transcript_entry in enumerate(transcript_data['batches']):
-                        if idx in used_transcript_indices:
-                            continue
-                        # Check if transcript overlaps with the interval
-                        if (transcript_entry['start_td'] < interval_end) and (
-                                transcript_entry['end_td'] > interval_start):
-                            transcript_summaries.append(transcript_entry['summary'])
-                            used_transcript_indices.add(idx)
-                            break  # Use each transcript entry only once
-
-                summaries.append({
-                    'start_time': format_timedelta(start_time),
-                    'end_time': format_timedelta(end_time),
-                    'slugcat': predominant_slugcat,
-                    'region': predominant_area,
-                    'rooms': ', '.join(top_room_names),
-                    'filenames': top_filenames,
-                    'subregions': ', '.join(top_subregion_names),
-                    'transcript': ' '.join(transcript_summaries) if transcript_summaries else ''
-                })
-            # Reset for next interval
-            start_time = end_time
-            end_time = start_time + timedelta(seconds=interval_seconds)
-            area_counts = {}
-            room_counts = {}
-            slugcat_counts = {}
-            filename_map = defaultdict(set)
-            subregion_counts = {}
-            continue  # Re-evaluate the same event for the new interval
-
-        # Aggregate counts
-        area = event['region']
-        area_counts[area] = area_counts.get(area, 0) + 1
-
-        room = event['room_key']
-        room_counts[room] = room_counts.get(room, 0) + 1
-
-        slugcat = event['slugcat']
-        slugcat_counts[slugcat] = slugcat_counts.get(slugcat, 0) + 1
-
-        filename = event['filename']
-        filename_map[room].add(filename)
-
-        subregion = event.get('room_metadata', {}).get('subregion')
-        subregion_counts[subregion] = subregion_counts.get(subregion, 0) + 1
-
-        event_index += 1
-
+    batches = transcript_data['batches'] if transcript_data and transcript_data['batches'] else []
+    transcripts = align_transcript(intervals, batches, all_transcripts)
+    for interval, transcript_summaries in zip(intervals, transcripts):
+        predominant_slugcat = interval['slugcat']
+        top_filenames = [
+            {'name': filename,
+             'path': f"./{predominant_slugcat}/{extract_region_from_filename(filename)}/{filename}"}
+            for room_filenames in interval['filenames']
+            for filename in room_filenames
+        ]
+
+        summaries.append({
+            'start_time': format_seconds(interval['start']),
+            'end_time': format_seconds(interval['end']),
+            'slugcat': predominant_slugcat,
+            'region': interval['region'],
+            'rooms': ', '.join(interval['rooms']),
+            'filenames': top_filenames,
+            'subregions': ', '.join(subregion for subregion in interval['subregions'] if subregion),
+            'transcript': ' '.join(summary for summary, _ in transcript_summaries)
+        })
     return summaries
 
 
+def summarize_locations(events, transcript_data=None, interval_minutes=5, subregion_limit=10, all_transcripts=False):
+    """Summarize player's predominant location and rooms for each interval."""
+    intervals = summarize_intervals(EventTable(events), interval_minutes * 60, subregion_limit=subregion_limit)
+    return overview_rows(intervals, transcript_data, all_transcripts)
+
+
 def generate_markdown(summaries, video_file, output_file, transcript_data=None):
     """Generate a markdown file summarizing the player's location data."""
     with open(output_file, 'w') as f:
@@ -300,12 +249,15 @@ def generate_html(summaries, video_file, output_file, transcript_data=None):
                 </thead>
                 <tbody>
     """
+    # Previews use the thumbnails extracted next to the screenshots if there are any, and are only loaded when visible
+    report_dir = os.path.dirname(os.path.abspath(output_file))
     for summary in summaries:
         html_filenames = ', '.join(
             [f"<a href='{filename['path']}'>{filename['name']}</a>" for filename in summary['filenames']]
         )
         preview_images = ''.join(
-            f"<img src='{filename['path']}' alt='{filename['name']}'>" for filename in summary['filenames'][:3]
+            f"<img src='{preview_path(filename['path'], report_dir)}' alt='{filename['name']}' loading='lazy'>"
+            for filename in summary['filenames'][:3]
         )
         html_content += f"""
                     <tr>
@@ -331,23 +283,51 @@ def generate_html(summaries, video_file, output_file, transcript_data=None):
     print(f"HTML file saved to {output_file.replace('.md', '.html')}")
 
 
-def main():
+def report_files(output_file, formats):
+    """Output file of every format, output_file with the extension of the format."""
+    root, extension = os.path.splitext(output_file)
+    if extension not in [f".{output_format}" for output_format in REPORT_FORMATS]:
+        root = output_file
+    return {output_format: f"{root}.{output_format}" for output_format in formats}
+
+
+def write_reports(events, output_files, video_file, transcript_data=None, interval_minutes=5, subregion_limit=10,
+                  all_transcripts=False):
+    """
+    Aggregate the events once and write a report for every format -> output file of output_files, markdown, HTML or
+    CSV.
+    """
+    interval_seconds = interval_minutes * 60
+    intervals = summarize_intervals(EventTable(events), interval_seconds, subregion_limit=subregion_limit)
+    summaries = overview_rows(intervals, transcript_data, all_transcripts)
+    for output_format, output_file in output_files.items():
+        if output_format == 'md':
+            generate_markdown(summaries, video_file, output_file, transcript_data)
+        elif output_format == 'html':
+            generate_html(summaries, video_file, output_file, transcript_data)
+        else:
+            save_summaries_to_csv(csv_rows(intervals, interval_seconds), output_file)
+
+
+def main(argv=None):
     parser = argparse.ArgumentParser(description='Generate a markdown summary for player locations.')
     parser.add_argument('json_file', help='Path to the input JSON file.')
-    parser.add_argument('--format', choices=['md', 'html'], default='md', help='Output format: markdown or HTML.')
-    parser.add_argument('-o', '--output_file', default='<json_filename>', help='Output markdown/HTML file name.')
+    parser.add_argument('--format', nargs='+', choices=REPORT_FORMATS, default=['md'],
+                        help='Output formats: markdown, HTML and/or CSV, all written from one aggregation.')
+    parser.add_argument('-o', '--output_file', default='<json_filename>',
+                        help='Output file name, the extension of every format is added.')
     parser.add_argument('-i', '--interval', type=int, default=5, help='Interval duration in minutes.')
     parser.add_argument('-s', '--subregion_limit', type=int, default=10,
                         help='Maximum number of subregions to include.')
     parser.add_argument('-t', '--transcript_file', help='Path to the transcript JSON file.')
-    args = parser.parse_args()
+    parser.add_argument('--all_transcripts', action='store_true',
+                        help='Show every transcript summary overlapping an interval, the ones overlapping it most '
+                             'first, instead of each summary only in the first interval it overlaps.')
+    args = parser.parse_args(argv)
 
     if args.output_file == '<json_filename>':
-        args.output_file = os.path.splitext(args.json_file)[0] + ('.md' if args.format == 'md' else '.html')
-    # Append correct filename if not provided
-    if (not args.output_file.endswith('.md') and args.format == 'md') or (
-            not args.output_file.endswith('.html') and args.format == 'html'):
-        args.output_file += '.md' if args.format == 'md' else '.html'
+        args.output_file = os.path.splitext(args.json_file)[0]
+    output_files = report_files(args.output_file, args.format)
 
     with open(args.json_file, 'r') as f:
         events = json.load(f)
@@ -359,17 +339,9 @@ def main():
     else:
         transcript_data = None
 
-    summaries = summarize_locations(
-        events,
-        transcript_data=transcript_data,
-        interval_minutes=args.interval,
-        subregion_limit=args.subregion_limit
-    )
-
-    if args.format == 'md':
-        generate_markdown(summaries, os.path.splitext(args.json_file)[0], args.output_file, transcript_data)
-    else:
-        generate_html(summaries, os.path.splitext(args.json_file)[0], args.output_file, transcript_data)
+    write_reports(events, output_files, os.path.splitext(args.json_file)[0], transcript_data,
+                  interval_minutes=args.interval, subregion_limit=args.subregion_limit,
+                  all_transcripts=args.all_transcripts)
 
 
 if __name__ == '__main__':
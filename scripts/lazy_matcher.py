@@ -0,0 +1,123 @@
+import copy
+import threading
+from collections import OrderedDict
+from image_matcher import ImageMatcher
+
+
+class ShardMatcher(ImageMatcher):
+    """An ImageMatcher of one known hash file, loaded without listing the base directory."""
+
+    def __init__(self, base_dir, slugcat, region, path, compact_distance=None):
+        self.hash_file = (slugcat, region, path)
+        super().__init__(base_dir, f"{slugcat}/{region}", compact_distance=compact_distance)
+
+    def iter_hash_files(self):
+        yield self.hash_file
+
+
+class LazyMatcher(ImageMatcher):
+    """
+    An ImageMatcher that only lists the included hash files at startup and loads the index of a slugcat/region, a
+    region shard, the first time a query searches it. Loaded shards are kept up to a memory budget, beyond which the
+    least recently used shards are dropped again, unless the shards searched by one query do not fit the budget, as
+    every query would then load them all again. A query without a search filter loads every shard. Metadata is only
+    shared within a shard, so the whole index takes more memory when loaded lazily than when loaded at once. The top n
+    of every shard are merged by distance, then in the order of the hash files, so the results are the same as those
+    of an ImageMatcher.
+    """
+
+    def __init__(self, base_dir, search_filter=None, profiler=None, compact_distance=None, memory_budget_mb=None):
+        self.memory_budget = int(memory_budget_mb * 1e6) if memory_budget_mb is not None else None
+        # Hash file path -> (shard matcher, estimated bytes), the most recently used last. Shared with the subsets.
+        self.shards = OrderedDict()
+        self.shards_lock = threading.Lock()
+        # keep_loaded is set once a query needed more shards than the budget holds, eviction then stops
+        self.shard_stats = {'loads': 0, 'evictions': 0, 'load_duration_s': 0.0, 'keep_loaded': False}
+        super().__init__(base_dir, search_filter, profiler, compact_distance)
+
+    def load_index(self):
+        # Only the layout of the index, the hashes are loaded by get_shard
+        self.hash_files = list(self.iter_hash_files())
+
+    def get_shard(self, slugcat, region, path, searched=()):
+        """
+        The matcher of one hash file, loaded if it is not loaded yet, dropping others beyond the memory budget. The
+        paths already searched by the current query are not dropped, the budget is given up instead.
+        """
+        with self.shards_lock:
+            if path in self.shards:
+                self.shards.move_to_end(path)
+                return self.shards[path][0]
+            with self.profiler.stage('load'):
+                shard = ShardMatcher(self.base_dir, slugcat, region, path, self.compact_distance)
+            self.shards[path] = (shard, shard.estimate_memory_bytes())
+            self.shard_stats['loads'] += 1
+            self.shard_stats['load_duration_s'] += shard.load_duration
+            # The shard that was just loaded is kept even if it alone exceeds the budget
+            while self.memory_budget is not None and not self.shard_stats['keep_loaded'] and len(self.shards) > 1 \
+                    and self.loaded_bytes() > self.memory_budget:
+                if next(iter(self.shards)) in searched:
+                    self.shard_stats['keep_loaded'] = True
+                    print(f"Warning: The regions searched by one query take more than the memory budget of "
+                          f"{self.memory_budget / 1e6:g} MB, so every query would load them again. Keeping the loaded "
+                          f"regions in memory from now on.")
+                    break
+                self.shards.popitem(last=False)
+                self.shard_stats['evictions'] += 1
+            return shard
+
+    def loaded_bytes(self):
+        return sum(size for _, size in self.shards.values())
+
+    def subset(self, search_filter):
+        """A lazy matcher over the hash files included by the search filter, sharing the loaded shards."""
+        subset = copy.copy(self)
+        subset.search_filter = search_filter
+        subset.filters = self.parse_search_filter(search_filter)
+        subset.hash_files = [(slugcat, region, path) for slugcat, region, path in self.hash_files
+                             if subset.includes(slugcat, region)]
+        return subset
+
+    def match_image(self, image):
+        matches = self.match_images_top_n([image], 1)[0]
+        return matches[0] if matches else None
+
+    def match_hashes_top_n(self, packed_hashes, n=1, group_by_room=False):
+        """
+        Top n matches for every packed query hash, searching the shards one after another. Rooms never span hash
+        files, so with group_by_room the best screenshots of the rooms of all shards are merged the same way.
+        """
+        with self.profiler.stage('search'):
+            self.profiler.count('queries', len(packed_hashes))
+            # (distance, hash file, row, shard) of the top n of every shard, per query
+            candidates = [[] for _ in packed_hashes]
+            searched = set()
+            for file_index, hash_file in enumerate(self.hash_files):
+                shard = self.get_shard(*hash_file, searched=searched)
+                searched.add(hash_file[2])
+                for query_candidates, (rows, distances) in zip(
+                        candidates, shard.top_n_candidates(packed_hashes, n, group_by_room)):
+                    query_candidates.extend((distance, file_index, row, shard)
+                                            for row, distance in zip(rows.tolist(), distances.tolist()))
+            return [[shard.build_match(row, distance)
+                     for distance, _, row, shard in sorted(query_candidates, key=lambda item: item[:3])[:n]]
+                    for query_candidates in candidates]
+
+    def index_info(self):
+        with self.shards_lock:
+            loaded = [shard for shard, _ in self.shards.values()]
+            memory = self.loaded_bytes()
+        return {
+            'entries': sum(len(shard.hash_matrix) for shard in loaded),
+            'hash_files': len(self.hash_files),
+            'hash_matrix_bytes': sum(int(shard.hash_matrix.nbytes) for shard in loaded),
+            'load_duration_s': round(self.load_duration, 3),
+            'loaded_at': self.loaded_at,
+            'loaded_shards': len(loaded),
+            'memory_bytes': memory,
+            'memory_budget_bytes': self.memory_budget,
+            'shard_loads': self.shard_stats['loads'],
+            'shard_evictions': self.shard_stats['evictions'],
+            'shard_load_duration_s': round(self.shard_stats['load_duration_s'], 3),
+            'shards_kept_loaded': self.shard_stats['keep_loaded'],
+        }
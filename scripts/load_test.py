@@ -0,0 +1,269 @@
+import argparse
+import http.client
+import json
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+import numpy as np
+from extract_hashes import extract_hashes, is_image_file
+from synthetic_dataset import generate_dataset, generate_labelled_frames
+
+CONTENT_TYPES = {'.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.bmp': 'image/bmp',
+                 '.tiff': 'image/tiff'}
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Replay screenshots against the /upload_image endpoint of '
+                                                 'identify_server.py and report throughput and latency.')
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='URL of a running identify_server.py.')
+    parser.add_argument('--images', help='Directory with the screenshots to upload, searched recursively.')
+    parser.add_argument('--concurrency', type=int, default=8, help='Number of requests in flight at the same time.')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='Requests per second to send at. 0 sends the next request as soon as one completes.')
+    parser.add_argument('--requests', type=int, default=1000, help='Number of requests to send.')
+    parser.add_argument('--duration', type=float, help='Stop sending after this many seconds instead.')
+    parser.add_argument('--warmup', type=int, default=20, help='Number of requests sent before measuring.')
+    parser.add_argument('--n', type=int, default=1, help='Number of matches requested per image.')
+    parser.add_argument('--timeout', type=float, default=30.0, help='Timeout of a single request in seconds.')
+    parser.add_argument('--start_server', metavar='BASE_DIR',
+                        help='Start identify_server.py on this base directory for the test and stop it afterward.')
+    parser.add_argument('--synthetic', type=int, metavar='ROOMS',
+                        help='Generate a synthetic dataset with this many rooms per region, start identify_server.py '
+                             'on it with --cache_size 0 and upload distorted frames of its screenshots.')
+    parser.add_argument('--server_args', default='', help='Further arguments for the started identify_server.py, '
+                                                          'for example "--workers 4 --cache_size 0".')
+    parser.add_argument('--output', help='Also write the results to this JSON file.')
+    return parser.parse_args()
+
+
+def load_images(images_dir):
+    images = []
+    for root, _, filenames in os.walk(images_dir):
+        for filename in sorted(filenames):
+            if is_image_file(filename):
+                with open(os.path.join(root, filename), 'rb') as f:
+                    images.append((f.read(), CONTENT_TYPES[os.path.splitext(filename)[1].lower()]))
+    return images
+
+
+def start_server(base_dir, url, server_args, log_file, timeout=120.0):
+    """
+    Starts identify_server.py with its output going to log_file and waits until it answers.
+    Returns the process, or None if it did not start.
+    """
+    parsed = urllib.parse.urlparse(url)
+    server_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'identify_server.py')
+    command = [sys.executable, server_script, base_dir, '--host', parsed.hostname, '--port', str(parsed.port or 80)]
+    process = subprocess.Popen(command + shlex.split(server_args), stdout=log_file, stderr=subprocess.STDOUT)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            return None
+        try:
+            with urllib.request.urlopen(url + '/admin/index', timeout=1):
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    return None
+
+
+def cache_stats(url, timeout):
+    """The statistics of the result cache of the server, or None if its cache is disabled or they cannot be read."""
+    try:
+        with urllib.request.urlopen(f"{url.rstrip('/')}/cache_stats", timeout=timeout) as response:
+            return json.load(response)
+    except (OSError, ValueError):
+        return None
+
+
+def cache_hit_rates(before, after):
+    """Hit rates of the result and upload caches between two cache_stats, or None without both."""
+    if before is None or after is None:
+        return None
+    rates = {}
+    for tier in ('result', 'upload'):
+        hits = after[tier + '_hits'] - before[tier + '_hits']
+        lookups = hits + after[tier + '_misses'] - before[tier + '_misses']
+        rates[tier + '_hit_rate'] = round(hits / lookups, 4) if lookups > 0 else None
+    return rates
+
+
+class LoadGenerator:
+    """
+    Sends the requests from concurrency threads, each with its own connection. With a rate, request i is due at
+    i / rate seconds after the start and its latency is measured from that moment, so that the time a request waited
+    for a free thread counts as well when the server cannot keep up.
+    """
+
+    def __init__(self, url, images, concurrency, rate, n, timeout):
+        parsed = urllib.parse.urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.path = f"{parsed.path.rstrip('/')}/upload_image?n={n}"
+        self.images = images
+        self.concurrency = concurrency
+        self.rate = rate
+        self.timeout = timeout
+        self.lock = threading.Lock()
+
+    def run(self, requests, duration=None):
+        self.next_request = 0
+        self.latencies = []
+        self.errors = {}
+        self.requests = requests
+        self.started = time.perf_counter()
+        self.deadline = None
+        if duration and self.rate > 0:
+            # Requests are taken ahead of the moment they are due, so the duration is turned into a number of requests
+            self.requests = int(duration * self.rate)
+        elif duration:
+            self.deadline = self.started + duration
+        threads = [threading.Thread(target=self.worker) for _ in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - self.started
+
+    def take_request(self):
+        with self.lock:
+            index = self.next_request
+            if (self.deadline is None and index >= self.requests) or \
+                    (self.deadline is not None and time.perf_counter() >= self.deadline):
+                return None
+            self.next_request += 1
+            return index
+
+    def worker(self):
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        while True:
+            index = self.take_request()
+            if index is None:
+                break
+            due = self.started + index / self.rate if self.rate > 0 else time.perf_counter()
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            body, content_type = self.images[index % len(self.images)]
+            error = None
+            try:
+                connection.request('POST', self.path, body=body, headers={'Content-Type': content_type})
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    error = f"HTTP {response.status}"
+            except (OSError, http.client.HTTPException) as e:
+                error = type(e).__name__
+                connection.close()
+            latency = time.perf_counter() - due
+            with self.lock:
+                if error is None:
+                    self.latencies.append(latency)
+                else:
+                    self.errors[error] = self.errors.get(error, 0) + 1
+        connection.close()
+
+    def summary(self, elapsed):
+        latencies = np.array(self.latencies) * 1000
+        failed = sum(self.errors.values())
+        total = len(latencies) + failed
+        summary = {
+            'requests': total,
+            'succeeded': len(latencies),
+            'failed': failed,
+            'error_rate': round(failed / total, 4) if total else None,
+            'errors': dict(self.errors),
+            'elapsed_s': round(elapsed, 3),
+            'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed > 0 else None,
+            'concurrency': self.concurrency,
+            'rate': self.rate or None,
+        }
+        if len(latencies):
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            summary.update({'mean_ms': round(float(latencies.mean()), 3), 'p50_ms': round(float(p50), 3),
+                            'p95_ms': round(float(p95), 3), 'p99_ms': round(float(p99), 3),
+                            'max_ms': round(float(latencies.max()), 3)})
+        return summary
+
+
+def main():
+    args = parse_arguments()
+    server = None
+    with tempfile.TemporaryDirectory(prefix='rwl-load-test-') as temp_dir:
+        images_dir = args.images
+        base_dir = args.start_server
+        server_args = args.server_args
+        if args.synthetic:
+            # The frames are uploaded again and again, which would only measure cache hits. Arguments given with
+            # --server_args come later and win.
+            server_args = f"--cache_size 0 {server_args}"
+            base_dir = os.path.join(temp_dir, 'dataset')
+            entries = generate_dataset(base_dir, rooms_per_region=args.synthetic)
+            extract_hashes(base_dir, verbose=False)
+            images_dir = os.path.join(temp_dir, 'frames')
+            generate_labelled_frames(entries, images_dir, min(len(entries), 500))
+        if not images_dir:
+            print("Error: Pass the screenshots to upload with --images, or use --synthetic.")
+            return
+        images = load_images(images_dir)
+        if not images:
+            print(f"Error: No images found in {images_dir}")
+            return
+
+        if base_dir:
+            print(f"Starting identify_server.py on {base_dir}")
+            server_log_path = os.path.join(temp_dir, 'server.log')
+            with open(server_log_path, 'w') as server_log:
+                server = start_server(base_dir, args.url, server_args, server_log)
+            if server is None:
+                with open(server_log_path, 'r') as f:
+                    print(f.read())
+                print("Error: identify_server.py did not start.")
+                return
+
+        try:
+            generator = LoadGenerator(args.url, images, args.concurrency, args.rate, args.n, args.timeout)
+            if args.warmup:
+                generator.run(args.warmup)
+            mode = f"at {args.rate:g} requests/s" if args.rate > 0 else "as fast as possible"
+            print(f"Sending {f'for {args.duration:g}s' if args.duration else f'{args.requests} requests'} of "
+                  f"{len(images)} images {mode} with concurrency {args.concurrency}")
+            cache_before = cache_stats(args.url, args.timeout)
+            elapsed = generator.run(args.requests, args.duration)
+            summary = generator.summary(elapsed)
+            summary['cache'] = cache_hit_rates(cache_before, cache_stats(args.url, args.timeout))
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=30)
+
+    print(f"Requests: {summary['requests']}, failed: {summary['failed']} ({(summary['error_rate'] or 0):.2%})")
+    for error, count in summary['errors'].items():
+        print(f"  {error}: {count}")
+    print(f"Throughput: {summary['throughput_rps']} requests/s")
+    if summary['succeeded']:
+        print(f"Latency: p50 {summary['p50_ms']:.2f} ms, p95 {summary['p95_ms']:.2f} ms, "
+              f"p99 {summary['p99_ms']:.2f} ms, max {summary['max_ms']:.2f} ms")
+    if summary['cache'] is not None:
+        # With several workers, the statistics are those of the worker that answered
+        rates = {tier: f"{rate:.2%}" if rate is not None else '-' for tier, rate in summary['cache'].items()}
+        print(f"Cache hit rate: {rates['result_hit_rate']} of results, {rates['upload_hit_rate']} of uploads")
+    else:
+        print("Cache: disabled, or its statistics are not available")
+
+    if args.output:
+        summary['arguments'] = vars(args)
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"Results saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
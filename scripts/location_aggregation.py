@@ -0,0 +1,126 @@
+import numpy as np
+
+
+def parse_seconds(timestamp):
+    """Seconds of a timestamp in 'h:mm:ss' format."""
+    hours, minutes, seconds = timestamp.split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+def format_seconds(seconds):
+    """Format seconds as 'h:mm:ss'."""
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{(seconds % 3600) // 60:02}:{seconds % 60:02}"
+
+
+def factorize(values):
+    """Codes of the values as an array and the distinct values, numbered in the order they first appear."""
+    codes_by_value = {}
+    codes = np.fromiter((codes_by_value.setdefault(value, len(codes_by_value)) for value in values), dtype=np.int64,
+                        count=len(values))
+    return codes, list(codes_by_value)
+
+
+class EventTable:
+    """
+    The matched events of a video in columns, sorted by time: the timestamp in seconds and a code per slugcat, region,
+    room, filename and subregion, each with its list of names. Events keep their order within the same second.
+    """
+
+    def __init__(self, events):
+        seconds = np.fromiter((parse_seconds(event['timestamp']) for event in events), dtype=np.int64,
+                              count=len(events))
+        order = np.argsort(seconds, kind='stable')
+        events = [events[index] for index in order.tolist()]
+        self.seconds = seconds[order]
+        self.codes, self.names = {}, {}
+        for column, values in (
+                ('slugcat', [event['slugcat'] for event in events]),
+                ('region', [event['region'] for event in events]),
+                ('room', [event['room_key'] for event in events]),
+                ('filename', [event['filename'] for event in events]),
+                ('subregion', [event.get('room_metadata', {}).get('subregion') for event in events])):
+            self.codes[column], self.names[column] = factorize(values)
+
+    def __len__(self):
+        return len(self.seconds)
+
+    def interval_ids(self, interval_seconds):
+        """Number of the interval of every event, the first interval starting with the first event."""
+        return (self.seconds - self.seconds[0]) // interval_seconds
+
+    def ranked(self, column, interval_ids):
+        """
+        (interval, code, count) arrays of every distinct code of the column in every interval, ordered by interval,
+        then by descending count, then by the first event of the code in the interval.
+        """
+        codes = self.codes[column]
+        code_count = len(self.names[column])
+        unique_keys, first, counts = np.unique(interval_ids * code_count + codes, return_index=True,
+                                               return_counts=True)
+        intervals = unique_keys // code_count
+        order = np.lexsort((first, -counts, intervals))
+        return intervals[order], (unique_keys % code_count)[order], counts[order]
+
+
+def group_starts(intervals):
+    """Index of the first row of every interval in rows sorted by interval."""
+    return np.flatnonzero(np.r_[True, intervals[1:] != intervals[:-1]]) if len(intervals) else np.zeros(0, int)
+
+
+def summarize_intervals(table, interval_seconds, room_limit=4, subregion_limit=10, subregion_min_count=5):
+    """
+    Aggregates the events of every interval that has events, in one pass over the columns. Returns a dict per interval
+    with its number, start and end in seconds, the predominant slugcat and region, the room_limit most frequent rooms
+    with the filenames of each in the order they were matched, and the subregion_limit most frequent subregions seen in
+    at least subregion_min_count events, where None stands for rooms without a subregion. Ties go to what was seen
+    first in the interval.
+    """
+    if not len(table):
+        return []
+    interval_ids = table.interval_ids(interval_seconds)
+    ranked = {column: table.ranked(column, interval_ids) for column in ('slugcat', 'region', 'room', 'subregion')}
+
+    def top(column, limit, min_count=1):
+        """(interval, code) arrays of the top codes of the column in every interval, in their order."""
+        intervals, codes, counts = ranked[column]
+        starts = group_starts(intervals)
+        ranks = np.arange(len(intervals)) - np.repeat(starts, np.diff(np.r_[starts, len(intervals)]))
+        keep = (ranks < limit) & (counts >= min_count)
+        return intervals[keep], codes[keep]
+
+    def names_by_interval(column, intervals, codes):
+        """Interval -> list of the names of the codes."""
+        starts = group_starts(intervals)
+        names = np.array(table.names[column], dtype=object)[codes]
+        return dict(zip(intervals[starts].tolist(), (group.tolist() for group in np.split(names, starts[1:]))))
+
+    slugcats = names_by_interval('slugcat', *top('slugcat', 1))
+    regions = names_by_interval('region', *top('region', 1))
+    subregions = names_by_interval('subregion', *top('subregion', subregion_limit, subregion_min_count))
+    room_intervals, room_codes = top('room', room_limit)
+    rooms = names_by_interval('room', room_intervals, room_codes)
+
+    # Distinct filenames of the top rooms of every interval, in the order they were first matched
+    room_names, filename_names = table.names['room'], table.names['filename']
+    event_rooms = interval_ids * len(room_names) + table.codes['room']
+    in_top_room = np.isin(event_rooms, room_intervals * len(room_names) + room_codes)
+    _, first = np.unique(event_rooms[in_top_room] * len(filename_names) + table.codes['filename'][in_top_room],
+                         return_index=True)
+    first = np.flatnonzero(in_top_room)[np.sort(first)]
+    filenames = {}
+    for interval, room, filename in zip(interval_ids[first].tolist(), table.codes['room'][first].tolist(),
+                                        table.codes['filename'][first].tolist()):
+        filenames.setdefault((interval, room_names[room]), []).append(filename_names[filename])
+
+    start = int(table.seconds[0])
+    return [{
+        'interval': interval,
+        'start': start + interval * interval_seconds,
+        'end': start + (interval + 1) * interval_seconds,
+        'slugcat': slugcats[interval][0],
+        'region': regions[interval][0],
+        'rooms': rooms[interval],
+        'filenames': [filenames[interval, room] for room in rooms[interval]],
+        'subregions': subregions.get(interval, []),
+    } for interval in sorted(rooms)]
@@ -0,0 +1,110 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+import numpy as np
+
+
+class MatchBatcher:
+    """
+    Collects the queries that arrive within a short window (or until a batch is full) and matches all of them with a
+    single distance computation, instead of scanning the dataset once per query. A query waiting alone is matched
+    at once, without waiting for the window: the queries arriving while it is matched form the next batch.
+    """
+
+    def __init__(self, get_matcher, window_ms=2.0, max_batch_size=32, stats_size=1000):
+        # The matcher is looked up for every batch, so that a replaced index is picked up by the next batch
+        self.get_matcher = get_matcher
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.pending = []
+        self.condition = threading.Condition()
+        # Guards the statistics, which are updated by the batcher thread and read by request threads
+        self.stats_lock = threading.Lock()
+        self.total_batches = 0
+        self.total_queries = 0
+        # (batch size, longest queue wait, match duration) of the most recent batches
+        self.recent_batches = deque(maxlen=stats_size)
+        self.thread = threading.Thread(target=self.run, name='match-batcher', daemon=True)
+        self.thread.start()
+
+    def submit(self, packed_hash, n=1, group_by_room=False):
+        future = Future()
+        with self.condition:
+            self.pending.append((packed_hash, n, group_by_room, future, time.perf_counter()))
+            if len(self.pending) == 1 or len(self.pending) >= self.max_batch_size:
+                self.condition.notify()
+        return future
+
+    def match(self, packed_hash, n=1, group_by_room=False):
+        return self.submit(packed_hash, n, group_by_room).result()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                # The window starts with the oldest waiting query, and is only waited for once queries overlap
+                deadline = self.pending[0][4] + self.window
+                while 1 < len(self.pending) < self.max_batch_size:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                batch = self.pending[:self.max_batch_size]
+                self.pending = self.pending[self.max_batch_size:]
+            try:
+                self.process(batch)
+            except Exception as e:
+                # The queries of the failed batch get the error, the thread goes on with the next batch
+                for _, _, _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def process(self, batch):
+        if not batch:
+            return
+        started = time.perf_counter()
+        matcher = self.get_matcher()
+        # Queries with and without grouping by room have different results, so they are matched separately
+        for group_by_room in {query[2] for query in batch}:
+            queries = [query for query in batch if query[2] == group_by_room]
+            # Matching with the largest n of the batch yields the top n of every other query as a prefix
+            max_n = max(n for _, n, _, _, _ in queries)
+            try:
+                results = matcher.match_hashes_top_n(np.stack([query[0] for query in queries]), max_n, group_by_room)
+            except Exception as e:
+                for _, _, _, future, _ in queries:
+                    future.set_exception(e)
+                continue
+            for (_, n, _, future, _), matches in zip(queries, results):
+                future.set_result(matches[:n])
+
+        finished = time.perf_counter()
+        with self.stats_lock:
+            self.total_batches += 1
+            self.total_queries += len(batch)
+            self.recent_batches.append((len(batch), started - batch[0][4], finished - started))
+
+    def stats(self):
+        with self.stats_lock:
+            total_batches, total_queries = self.total_batches, self.total_queries
+            recent = np.array(list(self.recent_batches), dtype=float).reshape(-1, 3)
+
+        def percentiles_ms(values):
+            if not len(values):
+                return None
+            p50, p95, p99 = np.percentile(values * 1000, [50, 95, 99])
+            return {'p50': round(p50, 3), 'p95': round(p95, 3), 'p99': round(p99, 3)}
+
+        return {
+            'window_ms': self.window * 1000,
+            'max_batch_size': self.max_batch_size,
+            'total_batches': total_batches,
+            'total_queries': total_queries,
+            'recent_batches': len(recent),
+            'mean_batch_size': round(float(recent[:, 0].mean()), 3) if len(recent) else None,
+            'max_batch_size_seen': int(recent[:, 0].max()) if len(recent) else None,
+            'queue_wait_ms': percentiles_ms(recent[:, 1]),
+            'match_latency_ms': percentiles_ms(recent[:, 2]),
+        }
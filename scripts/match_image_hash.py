@@ -1,31 +1,73 @@
-import cv2
 import argparse
-from image_matcher import ImageMatcher
+from daemon_client import DaemonClient, DaemonError, STATUS_INVALID_IMAGE
 
 
-def parse_arguments():
+def parse_arguments(argv=None):
     parser = argparse.ArgumentParser(description='Match an image to the dataset using image hashing.')
     parser.add_argument('image_file', help='Path to the input image file.')
     parser.add_argument('base_dir', help='Base directory containing images.')
     parser.add_argument('--search_filter',
                         help='Comma-separated list of slugcat/region pairs or slugcat names to filter the search.')
-    return parser.parse_args()
+    parser.add_argument('--socket', help='Socket of the matcher daemon, if it was started with a different one.')
+    parser.add_argument('--no_daemon', action='store_true',
+                        help='Load the index in this process even if a matcher daemon is running.')
+    return parser.parse_args(argv)
 
 
-def main():
-    args = parse_arguments()
+def match_with_daemon(client, image_file, search_filter):
+    """
+    The best match found by the daemon, False if the image cannot be read. Raises OSError if the connection to the
+    daemon fails.
+    """
+    try:
+        with open(image_file, 'rb') as f:
+            image_data = f.read()
+    except OSError:
+        return False
+    try:
+        matches = client.match_image_file(image_data, search_filter=search_filter)
+    except DaemonError as e:
+        if e.status == STATUS_INVALID_IMAGE:
+            return False
+        raise
+    return matches[0] if matches else None
+
+
+def match_in_process(image_file, base_dir, search_filter):
+    """The best match with the index loaded in this process, False if the image cannot be read."""
+    # Only imported when there is no daemon, as importing them takes longer than asking the daemon
+    import cv2
+    from image_matcher import ImageMatcher
+
+    image = cv2.imread(image_file)
+    if image is None:
+        return False
+    matcher = ImageMatcher(base_dir, search_filter)
+    return matcher.match_image(image)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
     image_file = args.image_file
     base_dir = args.base_dir
     search_filter = args.search_filter
 
-    image = cv2.imread(image_file)
-    if image is None:
+    client = None if args.no_daemon else DaemonClient.connect(base_dir, args.socket)
+    if client is not None:
+        try:
+            best_match = match_with_daemon(client, image_file, search_filter)
+        except OSError as e:
+            # A timeout or a daemon that stopped while answering, the index is loaded here as without a daemon
+            print(f"Warning: The matcher daemon did not answer ({e}), loading the index in this process instead.")
+            best_match = match_in_process(image_file, base_dir, search_filter)
+        finally:
+            client.close()
+    else:
+        best_match = match_in_process(image_file, base_dir, search_filter)
+    if best_match is False:
         print(f"Error: Unable to read image {image_file}")
         return
 
-    matcher = ImageMatcher(base_dir, search_filter)
-    best_match = matcher.match_image(image)
-
     if best_match:
         print("Best match found:")
         print(f"Slugcat: {best_match['slugcat']}")
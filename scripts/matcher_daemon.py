@@ -0,0 +1,174 @@
+import argparse
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+from daemon_client import (DaemonClient, FLAG_GROUP_BY_ROOM, INFO, MATCH_HASHES, MATCH_IMAGE, MAX_PAYLOAD_BYTES,
+                           PROTOCOL_VERSION, REQUEST_HEADER, RESPONSE_HEADER, STATUS_ERROR, STATUS_INVALID_IMAGE,
+                           STATUS_OK, default_socket_path, read_exactly)
+
+# Number of matchers for different search filters kept by the daemon
+MAX_SUBSETS = 16
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Keep the index loaded and answer match requests of the other '
+                                                 'scripts over a Unix domain socket.')
+    parser.add_argument('base_dir', help='Base directory containing images.')
+    parser.add_argument('--socket', help='Path of the socket. Default is a file in the temporary directory that is '
+                                         'derived from base_dir, where the other scripts look for it.')
+    parser.add_argument('--lazy', action='store_true',
+                        help='Load each slugcat/region the first time a request searches it.')
+    parser.add_argument('--memory_budget_mb', type=float,
+                        help='With --lazy, drop the least recently searched regions beyond this many megabytes.')
+    parser.add_argument('--compact_distance', type=int,
+                        help='Merge screenshots whose hashes differ in at most this many bits into one searched '
+                             'representative, see identify_server.py.')
+    parser.add_argument('--watch_interval', type=float, default=10.0,
+                        help='Check the hash files for changes every x seconds and reload the index when they '
+                             'changed. 0 disables watching. Default is 10.')
+    return parser.parse_args(argv)
+
+
+class MatcherDaemon:
+    """Answers the requests of all connections with the loaded matcher, reloading it when the hash files change."""
+
+    def __init__(self, create_matcher, socket_path, watch_interval):
+        self.create_matcher = create_matcher
+        self.socket_path = socket_path
+        self.matcher = create_matcher()
+        # Search filter -> subset of the current matcher, the most recently created last
+        self.subsets = {}
+        self.lock = threading.Lock()
+        self.watch_interval = watch_interval
+
+    def get_matcher(self, search_filter):
+        with self.lock:
+            matcher = self.matcher
+            if not search_filter:
+                return matcher
+            subset = self.subsets.get(search_filter)
+            if subset is None:
+                if len(self.subsets) >= MAX_SUBSETS:
+                    del self.subsets[next(iter(self.subsets))]
+                subset = self.subsets[search_filter] = matcher.subset(search_filter)
+            return subset
+
+    def handle(self, message_type, flags, n, search_filter, payload):
+        """The status and result of a request."""
+        # Already imported by the loaded matcher
+        import cv2
+        import numpy as np
+        group_by_room = bool(flags & FLAG_GROUP_BY_ROOM)
+        if message_type == INFO:
+            return STATUS_OK, self.matcher.index_info()
+        matcher = self.get_matcher(search_filter)
+        if message_type == MATCH_IMAGE:
+            image = cv2.imdecode(np.frombuffer(payload, np.uint8), cv2.IMREAD_COLOR) if payload else None
+            if image is None:
+                return STATUS_INVALID_IMAGE, {'error': 'Invalid image data'}
+            return STATUS_OK, matcher.match_image_top_n(image, n, group_by_room)
+        if message_type == MATCH_HASHES:
+            if len(payload) % matcher.hash_bytes:
+                return STATUS_ERROR, {'error': f"Hashes must be {matcher.hash_bytes} bytes long"}
+            packed_hashes = np.frombuffer(payload, np.uint8).reshape(-1, matcher.hash_bytes)
+            return STATUS_OK, matcher.match_hashes_top_n(packed_hashes, n, group_by_room)
+        return STATUS_ERROR, {'error': f"Unknown request type {message_type}"}
+
+    def watch(self):
+        """Reloads the index whenever one of its hash files is added, removed or rewritten."""
+        while True:
+            time.sleep(self.watch_interval)
+            try:
+                changed = self.matcher.index_signature() != self.matcher.signature
+            except OSError as e:
+                print(f"Warning: Unable to check the index for changes: {e}")
+                continue
+            if changed:
+                matcher = self.create_matcher()
+                with self.lock:
+                    self.matcher = matcher
+                    self.subsets = {}
+                print(f"Index reloaded in {matcher.load_duration:.3f}s")
+
+    def serve_forever(self):
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                # A connection sends any number of requests, one after another
+                while True:
+                    header = read_exactly(self.rfile, REQUEST_HEADER.size)
+                    if header is None:
+                        return
+                    version, message_type, flags, n, filter_length, payload_length = REQUEST_HEADER.unpack(header)
+                    if version != PROTOCOL_VERSION or payload_length > MAX_PAYLOAD_BYTES:
+                        self.respond(STATUS_ERROR, {'error': 'Unsupported protocol version or request too large'})
+                        return
+                    search_filter = read_exactly(self.rfile, filter_length)
+                    payload = read_exactly(self.rfile, payload_length)
+                    if search_filter is None or payload is None:
+                        return
+                    try:
+                        status, result = daemon.handle(message_type, flags, n, search_filter.decode('utf-8'), payload)
+                    except Exception as e:
+                        status, result = STATUS_ERROR, {'error': str(e)}
+                    self.respond(status, result)
+
+            def respond(self, status, result):
+                response = json.dumps(result, default=str).encode('utf-8')
+                self.wfile.write(RESPONSE_HEADER.pack(status, len(response)) + response)
+
+        class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+
+        if self.watch_interval > 0:
+            threading.Thread(target=self.watch, name='index-watcher', daemon=True).start()
+        with Server(self.socket_path, Handler) as server:
+            try:
+                server.serve_forever()
+            finally:
+                os.unlink(self.socket_path)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    if not hasattr(socket, 'AF_UNIX'):
+        print("Error: Unix domain sockets are not available on this platform.")
+        return
+    socket_path = args.socket or default_socket_path(args.base_dir)
+    if os.path.exists(socket_path):
+        client = DaemonClient.connect(args.base_dir, socket_path)
+        if client is not None:
+            client.close()
+            print(f"Error: A matcher daemon is already listening on {socket_path}")
+            return
+        os.unlink(socket_path)
+
+    base_dir = os.path.abspath(args.base_dir)
+
+    def create_matcher():
+        # Imported here, so that --help and the checks above do not wait for OpenCV and numpy
+        from image_matcher import ImageMatcher
+        from lazy_matcher import LazyMatcher
+        if args.lazy:
+            return LazyMatcher(base_dir, compact_distance=args.compact_distance,
+                               memory_budget_mb=args.memory_budget_mb)
+        return ImageMatcher(base_dir, compact_distance=args.compact_distance)
+
+    daemon = MatcherDaemon(create_matcher, socket_path, args.watch_interval)
+    print(f"Index loaded in {daemon.matcher.load_duration:.3f}s, listening on {socket_path}")
+    # Stopping with a signal removes the socket file as well
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
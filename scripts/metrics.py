@@ -0,0 +1,202 @@
+import bisect
+import itertools
+import multiprocessing
+import os
+import time
+from stage_profiler import NULL_PROFILER
+
+# Upper bounds of the latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Upper bounds of the payload size histogram buckets in bytes
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+class MetricsRegistry:
+    """
+    Counters, gauges and histograms rendered in the Prometheus text format.
+    All values live in one block of shared memory allocated up front, so worker processes forked after the metrics
+    were declared all update the same values, and any of them can answer a scrape for the whole server.
+    For the same reason, every label combination has to be declared together with its metric.
+    """
+
+    def __init__(self, max_values=4096):
+        self.values = multiprocessing.RawArray('d', max_values)
+        self.lock = multiprocessing.Lock()
+        self.allocated = 0
+        self.metrics = []
+
+    def allocate(self, size):
+        if self.allocated + size > len(self.values):
+            raise ValueError(f"The metrics registry is limited to {len(self.values)} values")
+        offset = self.allocated
+        self.allocated += size
+        return offset
+
+    def add(self, offset, amount):
+        with self.lock:
+            self.values[offset] += amount
+
+    def set(self, offset, value):
+        self.values[offset] = value
+
+    def counter(self, name, documentation, labels=None):
+        return self.register(Counter(self, name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=None):
+        return self.register(Gauge(self, name, documentation, labels))
+
+    def histogram(self, name, documentation, buckets, labels=None):
+        return self.register(Histogram(self, name, documentation, buckets, labels))
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+def format_value(value):
+    value = float(value)
+    if value.is_integer() and abs(value) < 2 ** 53:
+        return str(int(value))
+    return repr(value)
+
+
+def format_labels(labels, extra=None):
+    items = list(labels.items()) + list((extra or {}).items())
+    if not items:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in items) + '}'
+
+
+def expand_labels(labels):
+    """All combinations of the declared label values, e.g. {'stage': ['hash', 'search']}."""
+    if not labels:
+        return [{}]
+    names = list(labels)
+    return [dict(zip(names, values)) for values in itertools.product(*(labels[name] for name in names))]
+
+
+class Metric:
+    type = None
+    values_per_child = 1
+
+    def __init__(self, registry, name, documentation, labels=None):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.children = {}
+        for child_labels in expand_labels(labels):
+            key = tuple(sorted(child_labels.items()))
+            self.children[key] = (child_labels, registry.allocate(self.values_per_child))
+
+    def offset(self, labels):
+        return self.children[tuple(sorted(labels.items()))][1]
+
+    def render(self):
+        return [f"{self.name}{format_labels(labels)} {format_value(self.registry.values[offset])}"
+                for labels, offset in self.children.values()]
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        self.registry.add(self.offset(labels), amount)
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        self.registry.set(self.offset(labels), value)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, registry, name, documentation, buckets, labels=None):
+        self.buckets = tuple(buckets)
+        # One count per bucket, including the implicit +Inf bucket, followed by the sum of all observations
+        self.values_per_child = len(self.buckets) + 2
+        super().__init__(registry, name, documentation, labels)
+
+    def observe(self, value, **labels):
+        offset = self.offset(labels)
+        bucket = bisect.bisect_left(self.buckets, value)
+        values = self.registry.values
+        with self.registry.lock:
+            values[offset + bucket] += 1
+            values[offset + len(self.buckets) + 1] += value
+
+    def render(self):
+        lines = []
+        values = self.registry.values
+        for labels, offset in self.children.values():
+            cumulative = 0
+            for index, bound in enumerate(self.buckets + (float('inf'),)):
+                cumulative += values[offset + index]
+                bound = '+Inf' if bound == float('inf') else format_value(bound)
+                lines.append(f"{self.name}_bucket{format_labels(labels, {'le': bound})} {format_value(cumulative)}")
+            total = values[offset + len(self.buckets) + 1]
+            lines.append(f"{self.name}_sum{format_labels(labels)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {format_value(cumulative)}")
+        return lines
+
+
+class _HistogramStage:
+    __slots__ = ('histogram', 'stage', 'started')
+
+    def __init__(self, histogram, stage):
+        self.histogram = histogram
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.perf_counter() - self.started, stage=self.stage)
+        return False
+
+
+class HistogramProfiler:
+    """Profiler (see stage_profiler.py) that observes the durations of the declared stages in a histogram."""
+
+    def __init__(self, histogram, stages):
+        self.histogram = histogram
+        self.stages = set(stages)
+
+    def stage(self, name):
+        if name not in self.stages:
+            return NULL_PROFILER.stage(name)
+        return _HistogramStage(self.histogram, name)
+
+    def record(self, name, seconds):
+        if name in self.stages:
+            self.histogram.observe(seconds, stage=name)
+
+    def count(self, name, amount=1):
+        pass
+
+
+def resident_memory_bytes():
+    """Resident memory of the current process, or None if it cannot be determined on this platform."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        # Peak instead of current resident memory, in kilobytes on Linux and bytes on macOS
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if os.uname().sysname == 'Darwin' else max_rss * 1024
+    except (ImportError, AttributeError):
+        return None
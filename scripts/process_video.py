@@ -1,13 +1,14 @@
 #!/usr/bin/env python3
-import cv2
 import argparse
 import os
 import json
 from datetime import timedelta
-from image_matcher import ImageMatcher
+from stage_profiler import StageProfiler, NULL_PROFILER
 
+DECODE_MODES = ('seek', 'grab')
 
-def parse_arguments():
+
+def parse_arguments(argv=None):
     parser = argparse.ArgumentParser(description='Process a video and match frames to the dataset.')
     parser.add_argument('video_file', help='Path to the input video file.')
     parser.add_argument('base_dir', help='Base directory containing images.')
@@ -17,34 +18,65 @@ def parse_arguments():
     parser.add_argument('--interval', type=float, default=10.0, help='Interval in seconds between frames to process.')
     parser.add_argument('--start_time', type=float, default=0.0, help='Start time in seconds.')
     parser.add_argument('--write_interval', type=int, default=10, help='Write the updated list every x intervals.')
-    return parser.parse_args()
+    parser.add_argument('--decode_mode', choices=DECODE_MODES, default='seek',
+                        help='seek: jump to every processed frame. grab: read through all frames in between instead, '
+                             'faster when the interval is shorter than the distance between keyframes.')
+    parser.add_argument('--shards', type=int, default=0,
+                        help='Split the index into this many row ranges, each searched by its own process. '
+                             'Useful for very large indexes on machines with several cores. Default is 0.')
+    parser.add_argument('--socket', help='Socket of the matcher daemon, if it was started with a different one.')
+    parser.add_argument('--no_daemon', action='store_true',
+                        help='Load the index in this process even if a matcher daemon is running.')
+    parser.add_argument('--profile', action='store_true',
+                        help='Print how long seeking, decoding, hashing, matching and writing took at the end.')
+    parser.add_argument('--profile_json', help='Also write the profile with every measured duration to this file.')
+    return parser.parse_args(argv)
 
 
 def format_time(seconds):
     return str(timedelta(seconds=int(seconds)))
 
 
-def main():
-    args = parse_arguments()
-    video_file = args.video_file
-    base_dir = args.base_dir
-    search_filter = args.search_filter
-    interval = args.interval
-    start_time = args.start_time
-    write_interval = args.write_interval
-
-    matcher = ImageMatcher(base_dir, search_filter)
-
+def create_matcher(base_dir, search_filter=None, profiler=None, shards=0, socket_path=None, use_daemon=True):
+    """The matcher daemon serving base_dir if one is running and no shards are asked for, else a loaded matcher."""
+    # The matchers import OpenCV and numpy, which is only worth it once a video is processed
+    from daemon_matcher import DaemonMatcher
+    from image_matcher import ImageMatcher
+    from sharded_matcher import ShardedMatcher
+    if shards == 0 and use_daemon:
+        matcher = DaemonMatcher.connect(base_dir, search_filter, profiler, socket_path)
+        if matcher is not None:
+            print(f"Using the matcher daemon at {matcher.client.socket_path}")
+            return matcher
+    if shards > 0:
+        return ShardedMatcher(base_dir, search_filter, profiler=profiler, shards=shards)
+    return ImageMatcher(base_dir, search_filter, profiler=profiler)
+
+
+def process_video(matcher, video_file, interval=10.0, start_time=0.0, json_filename=None, write_interval=10,
+                  results=None, on_progress=None, should_stop=None, verbose=True, profiler=None, decode_mode='seek'):
+    """
+    Match a frame every interval seconds of the video and return the matches, or None if the video cannot be read.
+    Results are appended to the given list while processing, to allow reading partial results, and written to the
+    JSON file every write_interval frames if one is given. on_progress(frames_processed, position, duration) is called
+    after every frame, and processing stops early once should_stop() returns True.
+    With decode_mode 'seek', the video is positioned on every processed frame, which makes the decoder start again
+    from the previous keyframe. With 'grab', the frames in between are grabbed without converting them to images.
+    The 'seek', 'grab', 'decode' and 'write' stages are measured with the given profiler, hashing and matching are
+    measured by the matcher's profiler.
+    """
+    import cv2
+    profiler = profiler or NULL_PROFILER
     cap = cv2.VideoCapture(video_file)
     if not cap.isOpened():
         print(f"Error: Unable to open video file {video_file}")
-        return
+        return None
 
     frame_rate = cap.get(cv2.CAP_PROP_FPS)
     if frame_rate == 0:
         print("Error: Unable to get frame rate of the video.")
         cap.release()
-        return
+        return None
     total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
     video_duration = total_frames / frame_rate
 
@@ -52,24 +84,39 @@ def main():
     start_frame = int(start_time * frame_rate)
     cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
 
-    frame_interval = int(frame_rate * interval)
+    # An interval shorter than a frame still advances by one frame, so processing always ends
+    frame_interval = max(1, int(frame_rate * interval))
     current_frame = start_frame
+    # Frame the capture is positioned on in grab mode
+    position = start_frame
 
-    results = []
+    if results is None:
+        results = []
     intervals_processed = 0
 
-    if args.output_file != 'infer':
-        json_filename = args.output_file
-    else:
-        video_filename = os.path.basename(video_file)
-        base_name, _ = os.path.splitext(video_filename)
-        json_filename = os.path.join(os.path.dirname(video_file), f"{base_name}.json")
-
     while current_frame < total_frames:
-        cap.set(cv2.CAP_PROP_POS_FRAMES, current_frame)
-        ret, frame = cap.read()
+        if should_stop is not None and should_stop():
+            break
+
+        if decode_mode == 'grab':
+            grabbed = 0
+            with profiler.stage('grab'):
+                while position < current_frame and cap.grab():
+                    position += 1
+                    grabbed += 1
+            profiler.count('grabs', grabbed)
+            with profiler.stage('decode'):
+                ret, frame = cap.read()
+            position += 1
+        else:
+            with profiler.stage('seek'):
+                cap.set(cv2.CAP_PROP_POS_FRAMES, current_frame)
+            profiler.count('seeks')
+            with profiler.stage('decode'):
+                ret, frame = cap.read()
         if not ret:
             break  # End of video or read error
+        profiler.count('frames')
 
         best_match = matcher.match_image(frame)
         timestamp = current_frame / frame_rate  # Time in seconds
@@ -86,26 +133,59 @@ def main():
                 'room_metadata': best_match['room_metadata']
             }
             results.append(result)
-            print(f"[{formatted_time}] Match found - {best_match['room_key']}")
-        else:
+            profiler.count('matches')
+            if verbose:
+                print(f"[{formatted_time}] Match found - {best_match['room_key']}")
+        elif verbose:
             print(f"[{formatted_time}] No match found.")
 
         current_frame += frame_interval
         intervals_processed += 1
+        if on_progress is not None:
+            on_progress(intervals_processed, timestamp, video_duration)
 
-        if intervals_processed % write_interval == 0:
+        if json_filename and intervals_processed % write_interval == 0:
             # Write the updated results to the JSON file
-            with open(json_filename, 'w') as f:
+            with profiler.stage('write'), open(json_filename, 'w') as f:
                 json.dump(results, f, indent=4)
             print(f"Results written to {json_filename}")
 
     cap.release()
 
     # Write any remaining results
-    with open(json_filename, 'w') as f:
-        json.dump(results, f, indent=4)
+    if json_filename:
+        with profiler.stage('write'), open(json_filename, 'w') as f:
+            json.dump(results, f, indent=4)
+
+    return results
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    video_file = args.video_file
+
+    if args.output_file != 'infer':
+        json_filename = args.output_file
+    else:
+        video_filename = os.path.basename(video_file)
+        base_name, _ = os.path.splitext(video_filename)
+        json_filename = os.path.join(os.path.dirname(video_file), f"{base_name}.json")
 
-    print(f"Processing complete. Results saved to {json_filename}")
+    profiler = StageProfiler() if args.profile or args.profile_json else None
+    matcher = create_matcher(args.base_dir, args.search_filter, profiler, shards=args.shards, socket_path=args.socket,
+                             use_daemon=not args.no_daemon)
+    results = process_video(matcher, video_file, interval=args.interval, start_time=args.start_time,
+                            json_filename=json_filename, write_interval=args.write_interval, profiler=profiler,
+                            decode_mode=args.decode_mode)
+
+    if results is not None:
+        print(f"Processing complete. Results saved to {json_filename}")
+
+    if args.profile:
+        print(profiler.report())
+    if args.profile_json:
+        profiler.write_json(args.profile_json)
+        print(f"Profile written to {args.profile_json}")
 
 
 if __name__ == '__main__':
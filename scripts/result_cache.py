@@ -0,0 +1,77 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    Bounded LRU cache of match results keyed on the query hash, n and grouping by room, with a second tier that maps
+    the digest of a raw upload to its hash, so that repeated uploads of the same file skip decoding and hashing too.
+    """
+
+    def __init__(self, max_entries=1024, on_lookup=None):
+        self.max_entries = max_entries
+        # Called with the tier ('result' or 'upload') and whether it was a hit after every lookup
+        self.on_lookup = on_lookup
+        self.results = OrderedDict()
+        self.upload_hashes = OrderedDict()
+        self.lock = threading.Lock()
+        # Incremented on every clear, so that results computed against a replaced index are not stored afterward
+        self.generation = 0
+        self.counters = {'result_hits': 0, 'result_misses': 0, 'upload_hits': 0, 'upload_misses': 0, 'evictions': 0}
+
+    @staticmethod
+    def upload_digest(image_data):
+        return hashlib.blake2b(image_data, digest_size=16).digest()
+
+    def lookup(self, table, key, counter):
+        with self.lock:
+            value = table.get(key)
+            if value is None:
+                self.counters[counter + '_misses'] += 1
+            else:
+                table.move_to_end(key)
+                self.counters[counter + '_hits'] += 1
+        if self.on_lookup is not None:
+            self.on_lookup(counter, value is not None)
+        return value
+
+    def store(self, table, key, value, generation):
+        with self.lock:
+            if generation != self.generation:
+                return
+            table[key] = value
+            table.move_to_end(key)
+            while len(table) > self.max_entries:
+                table.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def get_upload_hash(self, digest):
+        return self.lookup(self.upload_hashes, digest, 'upload')
+
+    def put_upload_hash(self, digest, packed_hash, generation):
+        self.store(self.upload_hashes, digest, packed_hash, generation)
+
+    def get_matches(self, packed_hash, n, group_by_room=False):
+        return self.lookup(self.results, (packed_hash.tobytes(), n, group_by_room), 'result')
+
+    def put_matches(self, packed_hash, n, matches, generation, group_by_room=False):
+        self.store(self.results, (packed_hash.tobytes(), n, group_by_room), matches, generation)
+
+    def clear(self):
+        with self.lock:
+            self.results.clear()
+            self.upload_hashes.clear()
+            self.generation += 1
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats['max_entries'] = self.max_entries
+            stats['results'] = len(self.results)
+            stats['upload_hashes'] = len(self.upload_hashes)
+            stats['generation'] = self.generation
+        for tier in ('result', 'upload'):
+            lookups = stats[tier + '_hits'] + stats[tier + '_misses']
+            stats[tier + '_hit_rate'] = round(stats[tier + '_hits'] / lookups, 4) if lookups else None
+        return stats
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+import argparse
+import importlib
+import os
+import sys
+
+# Subcommand -> (module, description). Only the module of the subcommand that runs is imported, so that no subcommand
+# pays for the imports (cv2, flask, pandas, requests, ...) of the others.
+COMMANDS = {
+    'extract': ('extract_hashes', 'Compute the hashes of the screenshots (extract_hashes.py).'),
+    'match': ('match_image_hash', 'Match a single image (match_image_hash.py).'),
+    'video': ('process_video', 'Match the frames of a video (process_video.py).'),
+    'report': ('interpret_overview_table', 'Generate the markdown or HTML overview of a processed video '
+                                          '(interpret_overview_table.py).'),
+    'csv': ('interpret_csv', 'Summarize the locations of a processed video into a CSV file (interpret_csv.py).'),
+    'summarize': ('transcript_summarizer', 'Summarize a video transcript (transcript_summarizer.py).'),
+    'serve': ('identify_server', 'Run the web interface and API (identify_server.py).'),
+    'daemon': ('matcher_daemon', 'Keep the index loaded for match and video (matcher_daemon.py).'),
+    'complete': ('complete', 'Process a video, summarize its transcript and generate the overview (complete.py).'),
+}
+
+
+def parse_arguments(argv=None):
+    epilog = 'commands:\n' + '\n'.join(f"  {name:<10} {description}" for name, (_, description) in COMMANDS.items())
+    parser = argparse.ArgumentParser(description='Rain World Region Locator. Run "%(prog)s COMMAND --help" for the '
+                                                 'arguments of a command.',
+                                     epilog=epilog, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=COMMANDS, metavar='COMMAND', help='The command to run, see below.')
+    parser.add_argument('arguments', nargs=argparse.REMAINDER, help='Arguments of the command.')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    module = importlib.import_module(COMMANDS[args.command][0])
+    # The usage printed by the command shows how it was called
+    sys.argv[0] = f"{os.path.basename(sys.argv[0])} {args.command}"
+    module.main(args.arguments)
+
+
+if __name__ == '__main__':
+    main()
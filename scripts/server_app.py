@@ -0,0 +1,695 @@
+from flask import Flask, request, render_template, jsonify, send_from_directory, g
+from werkzeug.serving import make_server
+import gc
+import json
+import math
+import os
+import signal
+import socket
+import threading
+import time
+import cv2
+import numpy as np
+import base64
+from image_matcher import ImageMatcher
+from lazy_matcher import LazyMatcher
+from sharded_matcher import ShardedMatcher
+from match_batcher import MatchBatcher
+from result_cache import ResultCache
+from thumbnails import preview_path
+from video_jobs import VideoJobManager
+from stream_session import StreamSession
+from metrics import MetricsRegistry, HistogramProfiler, LATENCY_BUCKETS, SIZE_BUCKETS, resident_memory_bytes
+from stage_profiler import NULL_PROFILER
+
+try:
+    from flask_sock import Sock
+    from simple_websocket import ConnectionClosed
+except ImportError:
+    # The live streaming endpoint is optional
+    Sock = None
+
+app = Flask(__name__)
+
+image_matcher = None
+match_batcher = None
+result_cache = None
+video_jobs = None
+server_metrics = None
+# Measures the decode, hash and search stages of the requests for the metrics, if they are enabled
+profiler = NULL_PROFILER
+reload_lock = threading.Lock()
+# Set in forked workers, which leave reloading the index to the parent process
+prefork_parent_pid = None
+# Number of shard worker processes searching the index, 0 searches it in the server process
+matcher_shards = 0
+# Whether region shards are loaded when they are first searched, and the memory budget of the loaded ones
+lazy_loading = False
+memory_budget_mb = None
+ABSOLUTE_PATH = None
+# Screenshots are addressed with the index version, so browsers can keep them for a long time
+IMAGE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+# Endpoints with request metrics of their own, all other requests are counted as 'other'
+METERED_ENDPOINTS = ('upload_image', 'upload_images', 'stream', 'submit_job', 'other')
+MEASURED_STAGES = ('decode', 'hash', 'search')
+
+
+class ServerMetrics:
+    """All metrics of the server, declared before any worker process is forked so that they share their values."""
+
+    def __init__(self):
+        self.registry = MetricsRegistry()
+        labels = {'endpoint': METERED_ENDPOINTS}
+        self.requests = self.registry.counter(
+            'rwl_http_requests_total', 'HTTP requests by endpoint and status class.',
+            {'endpoint': METERED_ENDPOINTS, 'status': ('2xx', '3xx', '4xx', '5xx')})
+        self.request_duration = self.registry.histogram(
+            'rwl_http_request_duration_seconds', 'Time to answer HTTP requests.', LATENCY_BUCKETS, labels)
+        self.request_size = self.registry.histogram(
+            'rwl_http_request_size_bytes', 'Size of HTTP request bodies.', SIZE_BUCKETS, labels)
+        self.stage_duration = self.registry.histogram(
+            'rwl_stage_duration_seconds', 'Time spent decoding, hashing and searching, per call.', LATENCY_BUCKETS,
+            {'stage': MEASURED_STAGES})
+        self.cache_lookups = self.registry.counter(
+            'rwl_cache_lookups_total', 'Result cache lookups by tier and outcome.',
+            {'tier': ('upload', 'result'), 'outcome': ('hit', 'miss')})
+        self.index_entries = self.registry.gauge('rwl_index_entries', 'Number of screenshots in the loaded index.')
+        self.index_bytes = self.registry.gauge('rwl_index_hash_bytes', 'Size of the packed hashes of the loaded index.')
+        self.index_load_duration = self.registry.gauge(
+            'rwl_index_load_duration_seconds', 'Time it took to load the current index.')
+        self.index_loaded_at = self.registry.gauge(
+            'rwl_index_loaded_timestamp_seconds', 'Unix time at which the current index was loaded.')
+
+    def set_index(self, matcher):
+        info = matcher.index_info()
+        self.index_entries.set(info['entries'])
+        self.index_bytes.set(info['hash_matrix_bytes'])
+        self.index_load_duration.set(matcher.load_duration)
+        self.index_loaded_at.set(matcher.loaded_at)
+
+    def record_cache_lookup(self, tier, hit):
+        self.cache_lookups.inc(tier=tier, outcome='hit' if hit else 'miss')
+
+    def render(self):
+        text = self.registry.render()
+        # Memory is reported by the process answering the scrape
+        memory = resident_memory_bytes()
+        if memory is not None:
+            text += ('# HELP process_resident_memory_bytes Resident memory of the process answering the scrape.\n'
+                     '# TYPE process_resident_memory_bytes gauge\n'
+                     f'process_resident_memory_bytes{{pid="{os.getpid()}"}} {memory}\n')
+        return text
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    if server_metrics is not None:
+        endpoint = request.endpoint if request.endpoint in METERED_ENDPOINTS else 'other'
+        server_metrics.requests.inc(endpoint=endpoint, status=f"{min(max(response.status_code // 100, 2), 5)}xx")
+        # The duration of a stream is the lifetime of its connection, which says nothing about latency
+        if endpoint != 'stream':
+            server_metrics.request_duration.observe(time.perf_counter() - g.request_started, endpoint=endpoint)
+        if request.content_length:
+            server_metrics.request_size.observe(request.content_length, endpoint=endpoint)
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    if server_metrics is None:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return server_metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+@app.route('/')
+def index():
+    return render_template('index.html')
+
+
+def read_upload():
+    """
+    Raw image bytes of an upload: a base64 data-URL in JSON, a multipart file or an image/* body, or None if there is
+    none, and the error response if the data-URL is malformed.
+    """
+    if request.is_json:
+        data = request.json.get('image')
+        if not data:
+            return None, None
+        if not isinstance(data, str) or ',' not in data:
+            return None, (jsonify({'error': 'image must be a base64 data-URL'}), 400)
+        # Decode the base64 image
+        header, encoded = data.split(',', 1)
+        try:
+            return base64.b64decode(encoded), None
+        except ValueError:
+            return None, (jsonify({'error': 'image must be a base64 data-URL'}), 400)
+    if 'image' in request.files:
+        return request.files['image'].read(), None
+    if request.mimetype.startswith('image/'):
+        return request.get_data(), None
+    return None, None
+
+
+def read_n():
+    """The number of matches requested, and the error response if it is not a positive integer."""
+    value = request.json.get('n', 1) if request.is_json else request.values.get('n', 1)
+    try:
+        n = int(value)
+    except (TypeError, ValueError):
+        n = 0
+    if n < 1:
+        return None, (jsonify({'error': 'n must be a positive integer'}), 400)
+    return n, None
+
+
+def read_group_by_room():
+    if request.is_json:
+        return bool(request.json.get('group_by_room', False))
+    return request.values.get('group_by_room', '').lower() in ('1', 'true', 'yes')
+
+
+def decode_image(image_data):
+    if not image_data:
+        return None
+    with profiler.stage('decode'):
+        np_arr = np.frombuffer(image_data, np.uint8)
+        return cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+
+
+def build_response_matches(matches):
+    response_data = []
+    # A reloaded index may come with new screenshots, so it must not hit previously cached ones
+    version = f"?v={int(image_matcher.loaded_at)}"
+    for match in matches:
+        filename = match['filename']
+        relative_path = match['slugcat'] + '/' + match['region'] + '/' + filename
+        response_data.append({
+            'slugcat': match['slugcat'],
+            'region': match['region'],
+            'filename': filename,
+            'room_key': match['room_key'],
+            'distance': match['distance'],
+            'image_path': '/images/' + relative_path + version,
+            'thumbnail_path': '/thumbnails/' + relative_path + version
+        })
+    return response_data
+
+
+def set_image_matcher(matcher):
+    """Replaces the matcher used by all requests, dropping every cached result of the previous one."""
+    global image_matcher
+    matcher.profiler = profiler
+    image_matcher = matcher
+    if result_cache is not None:
+        result_cache.clear()
+    if server_metrics is not None:
+        server_metrics.set_index(matcher)
+
+
+def match_packed_hash(packed_hash, n, group_by_room=False):
+    # Get top N matches, together with other queries arriving at the same time if batching is enabled
+    if match_batcher is not None:
+        return match_batcher.match(packed_hash, n, group_by_room)
+    return image_matcher.match_hashes_top_n(packed_hash[None, :], n, group_by_room)[0]
+
+
+@app.route('/upload_image', methods=['POST'])
+def upload_image():
+    image_data, error = read_upload()
+    if error:
+        return error
+    n, error = read_n()
+    if error:
+        return error
+    group_by_room = read_group_by_room()
+
+    if not image_data:
+        return jsonify({'error': 'No image data received'}), 400
+
+    if result_cache is None:
+        image = decode_image(image_data)
+        if image is None:
+            return jsonify({'error': 'Invalid image data'}), 400
+        matches = match_packed_hash(image_matcher.hash_images([image])[0], n, group_by_room)
+    else:
+        # Repeated uploads of the same file skip decoding, repeated hashes skip matching
+        generation = result_cache.generation
+        digest = ResultCache.upload_digest(image_data)
+        packed_hash = result_cache.get_upload_hash(digest)
+        if packed_hash is None:
+            image = decode_image(image_data)
+            if image is None:
+                return jsonify({'error': 'Invalid image data'}), 400
+            packed_hash = image_matcher.hash_images([image])[0]
+            result_cache.put_upload_hash(digest, packed_hash, generation)
+        matches = result_cache.get_matches(packed_hash, n, group_by_room)
+        if matches is None:
+            matches = match_packed_hash(packed_hash, n, group_by_room)
+            result_cache.put_matches(packed_hash, n, matches, generation, group_by_room)
+
+    if not matches:
+        return jsonify({'error': 'No matches found'}), 200
+
+    return jsonify({'matches': build_response_matches(matches)}), 200
+
+
+@app.route('/upload_images', methods=['POST'])
+def upload_images():
+    files = request.files.getlist('images')
+    n, error = read_n()
+    if error:
+        return error
+    group_by_room = read_group_by_room()
+
+    if not files:
+        return jsonify({'error': 'No image data received'}), 400
+
+    # Decode everything first, so that all valid images are matched in a single call
+    results = []
+    images = []
+    for file in files:
+        image = decode_image(file.read())
+        if image is None:
+            results.append({'filename': file.filename, 'error': 'Invalid image data'})
+        else:
+            results.append({'filename': file.filename, 'matches': None})
+            images.append(image)
+
+    all_matches = iter(image_matcher.match_images_top_n(images, n, group_by_room))
+    for result in results:
+        if 'error' not in result:
+            result['matches'] = build_response_matches(next(all_matches))
+
+    return jsonify({'results': results}), 200
+
+
+@app.route('/images/<slugcat>/<region>/<filename>', methods=['GET'])
+def full_image(slugcat, region, filename):
+    return send_from_directory(ABSOLUTE_PATH, f"{slugcat}/{region}/{filename}", max_age=IMAGE_MAX_AGE)
+
+
+@app.route('/thumbnails/<slugcat>/<region>/<filename>', methods=['GET'])
+def thumbnail_image(slugcat, region, filename):
+    # Falls back to the full screenshot if no thumbnail was extracted for it
+    path = preview_path(f"{slugcat}/{region}/{filename}", ABSOLUTE_PATH)
+    return send_from_directory(ABSOLUTE_PATH, path, max_age=IMAGE_MAX_AGE)
+
+
+@app.route('/get_base_path', methods=['GET'])
+def get_base_path():
+    global ABSOLUTE_PATH
+    return jsonify({'base_path': ABSOLUTE_PATH})
+
+
+@app.route('/batch_stats', methods=['GET'])
+def batch_stats():
+    if match_batcher is None:
+        return jsonify({'error': 'Request batching is disabled'}), 404
+    return jsonify(match_batcher.stats()), 200
+
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    if result_cache is None:
+        return jsonify({'error': 'Result caching is disabled'}), 404
+    return jsonify(result_cache.stats()), 200
+
+
+def receive_frames(ws, session):
+    """
+    Reads messages from the stream as fast as they arrive: binary messages are encoded (downscaled) frames,
+    text messages are JSON with a new 'n' or 'group_by_room' and/or a 'hash' computed by the client, as a hex string
+    of the packed bits.
+    """
+    try:
+        while True:
+            message = ws.receive()
+            if isinstance(message, str):
+                try:
+                    data = json.loads(message)
+                    if 'n' in data:
+                        session.n = int(data['n'])
+                    if 'group_by_room' in data:
+                        session.group_by_room = bool(data['group_by_room'])
+                    if 'hash' in data:
+                        session.offer(bytes.fromhex(data['hash']))
+                except (ValueError, TypeError):
+                    continue
+            else:
+                session.offer(('image', message))
+    except ConnectionClosed:
+        pass
+    finally:
+        session.close()
+
+
+if Sock is not None:
+    sock = Sock(app)
+
+    @sock.route('/stream')
+    def stream(ws):
+        """Continuous identification of the frames of a live capture, with results pushed back for every frame."""
+        session = StreamSession()
+        threading.Thread(target=receive_frames, args=(ws, session), name='stream-receiver', daemon=True).start()
+        session_matcher = image_matcher
+        while True:
+            message = session.take()
+            if message is None:
+                break
+            matcher = image_matcher
+            if matcher is not session_matcher:
+                # Results of a replaced index must not be reused
+                session.recent.clear()
+                session_matcher = matcher
+            if isinstance(message, tuple):
+                image = decode_image(message[1])
+                if image is None:
+                    ws.send(json.dumps({'error': 'Invalid image data'}))
+                    continue
+                packed_hash = matcher.hash_images([image])[0]
+            else:
+                packed_hash = np.frombuffer(message, dtype=np.uint8)
+                if packed_hash.shape[0] != matcher.hash_bytes:
+                    ws.send(json.dumps({'error': f"Hashes must be {matcher.hash_bytes} bytes long"}))
+                    continue
+
+            n = session.n
+            group_by_room = session.group_by_room
+            matches = session.lookup(packed_hash, n, group_by_room)
+            cached = matches is not None
+            if matches is None:
+                matches = match_packed_hash(packed_hash, n, group_by_room)
+                session.remember(packed_hash, n, matches, group_by_room)
+            ws.send(json.dumps({'matches': build_response_matches(matches), 'cached': cached,
+                                'hash': packed_hash.tobytes().hex(), **session.counters}))
+
+
+def find_job(job_id):
+    if video_jobs is None:
+        return None, (jsonify({'error': 'Video jobs are disabled, start the server with --job_workers'}), 404)
+    job = video_jobs.get(job_id)
+    if job is None:
+        return None, (jsonify({'error': f"Unknown job {job_id}"}), 404)
+    return job, None
+
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    if video_jobs is None:
+        return jsonify({'error': 'Video jobs are disabled, start the server with --job_workers'}), 404
+    data = request.json or {}
+    video_file = data.get('video_file')
+    if not video_file or not os.path.isfile(video_file):
+        return jsonify({'error': f"Video file {video_file} does not exist"}), 400
+    try:
+        interval = float(data.get('interval', 10.0))
+        start_time = float(data.get('start_time', 0.0))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'interval and start_time must be numbers'}), 400
+    if not math.isfinite(interval) or interval <= 0:
+        return jsonify({'error': 'interval must be a positive number of seconds'}), 400
+    if not math.isfinite(start_time) or start_time < 0:
+        return jsonify({'error': 'start_time must not be negative'}), 400
+    job = video_jobs.submit(video_file, search_filter=data.get('search_filter') or None, interval=interval,
+                            start_time=start_time)
+    if job is None:
+        return jsonify({'error': 'Too many video jobs are queued, try again later'}), 429
+    return jsonify(job.info()), 202
+
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    if video_jobs is None:
+        return jsonify({'error': 'Video jobs are disabled, start the server with --job_workers'}), 404
+    return jsonify({'jobs': [job.info() for job in video_jobs.list_jobs()]}), 200
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_progress(job_id):
+    job, error = find_job(job_id)
+    return error or (jsonify(job.info()), 200)
+
+
+@app.route('/jobs/<job_id>/results', methods=['GET'])
+def job_results(job_id):
+    job, error = find_job(job_id)
+    if error:
+        return error
+    # Clients polling for partial results only fetch the ones they have not seen yet
+    offset = request.args.get('offset', '0')
+    if not offset.isdecimal():
+        return jsonify({'error': 'offset must be a non-negative integer'}), 400
+    offset = int(offset)
+    results = job.results[offset:]
+    return jsonify({'status': job.status, 'results': results, 'next_offset': offset + len(results)}), 200
+
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    job, error = find_job(job_id)
+    if error:
+        return error
+    video_jobs.cancel(job_id)
+    return jsonify(job.info()), 200
+
+
+@app.route('/admin/reload', methods=['POST'])
+def admin_reload():
+    if prefork_parent_pid is not None:
+        # The parent loads the new index once and replaces all workers with ones sharing it
+        os.kill(prefork_parent_pid, signal.SIGHUP)
+        return jsonify({'status': 'reloading'}), 202
+    if not reload_index():
+        return jsonify({'error': 'The index is already being reloaded'}), 409
+    return jsonify({'status': 'reloading'}), 202
+
+
+@app.route('/admin/index', methods=['GET'])
+def admin_index():
+    info = image_matcher.index_info()
+    info['reloading'] = reload_lock.locked()
+    return jsonify(info), 200
+
+
+def create_image_matcher(base_dir, search_filter, compact_distance):
+    if lazy_loading:
+        return LazyMatcher(base_dir, search_filter=search_filter, compact_distance=compact_distance,
+                           memory_budget_mb=memory_budget_mb)
+    if matcher_shards > 0:
+        return ShardedMatcher(base_dir, search_filter=search_filter, compact_distance=compact_distance,
+                              shards=matcher_shards)
+    return ImageMatcher(base_dir, search_filter=search_filter, compact_distance=compact_distance)
+
+
+def load_image_matcher():
+    """Loads the index again, with the same directory and filter as the current one."""
+    matcher = create_image_matcher(image_matcher.base_dir, image_matcher.search_filter, image_matcher.compact_distance)
+    info = matcher.index_info()
+    print(f"Index loaded in {info['load_duration_s']}s: {info['entries']} entries from {info['hash_files']} "
+          f"hash files ({info['hash_matrix_bytes']} bytes of hashes)")
+    print_index_layout(info)
+    return matcher
+
+
+def print_index_layout(info):
+    if 'representatives' in info:
+        print(f"Compacted {info['entries']} entries into {info['representatives']} representatives within "
+              f"{info['compact_distance']} bits ({info['compression_ratio']}x)")
+    if 'shards' in info:
+        print(f"Searching {info['entries']} entries in {info['shards']} shard processes")
+    if 'loaded_shards' in info:
+        budget = f"{info['memory_budget_bytes'] / 1e6:g} MB" if info['memory_budget_bytes'] is not None else "no"
+        print(f"Listed {info['hash_files']} hash files, each is loaded when it is first searched "
+              f"({budget} memory budget)")
+
+
+def reload_index():
+    """
+    Loads the index in a background thread and swaps it in once it is complete.
+    Requests that already started keep using the previous matcher until they are done.
+    """
+    if not reload_lock.acquire(blocking=False):
+        return False
+
+    def run():
+        try:
+            set_image_matcher(load_image_matcher())
+        except Exception as e:
+            print(f"Error: Unable to reload the index, keeping the previous one: {e}")
+        finally:
+            reload_lock.release()
+
+    threading.Thread(target=run, name='index-reload', daemon=True).start()
+    return True
+
+
+def index_changed():
+    try:
+        return image_matcher.index_signature() != image_matcher.signature
+    except OSError as e:
+        # Files can disappear while extract_hashes.py rewrites them, try again next time
+        print(f"Warning: Unable to check the index for changes: {e}")
+        return False
+
+
+def watch_index(interval):
+    """Reloads the index whenever one of its hash files is added, removed or rewritten."""
+    while True:
+        time.sleep(interval)
+        if index_changed():
+            reload_index()
+
+
+def init_worker(args):
+    """Starts the per-process services of a serving process, after it has been forked."""
+    global match_batcher, result_cache, video_jobs
+    # Jobs only live in the process that accepted them, so they are not available with multiple workers
+    if args.job_workers > 0 and args.workers == 1:
+        video_jobs = VideoJobManager(lambda: image_matcher, max_workers=args.job_workers,
+                                     max_queued=args.max_queued_jobs)
+    if args.cache_size > 0:
+        result_cache = ResultCache(max_entries=args.cache_size,
+                                   on_lookup=server_metrics.record_cache_lookup if server_metrics else None)
+    if args.batch_window_ms > 0:
+        match_batcher = MatchBatcher(lambda: image_matcher, window_ms=args.batch_window_ms,
+                                     max_batch_size=args.max_batch_size)
+
+
+def serve_prefork(args):
+    """
+    Serve the app from multiple worker processes that are forked after the index has been loaded, so that they all
+    share the memory of the same read-only index copy-on-write instead of loading their own.
+    To reload the index, the parent loads it once and replaces the workers with new ones forked afterward, while the
+    previous workers finish the requests they already accepted.
+    """
+    host, port, workers = args.host, args.port, args.workers
+    listen_socket = socket.create_server((host, port), family=socket.AF_INET6 if ':' in host else socket.AF_INET)
+    listen_socket.set_inheritable(True)
+    parent_pid = os.getpid()
+
+    def spawn_worker():
+        pid = os.fork()
+        if pid == 0:
+            global prefork_parent_pid
+            prefork_parent_pid = parent_pid
+            # Interrupts are handled by the parent, which then stops the workers gracefully
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            init_worker(args)
+            server = make_server(host, port, app, threaded=True, fd=listen_socket.fileno())
+            # Wait for requests that are in flight when stopping instead of dropping them
+            server.daemon_threads = False
+            signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+            try:
+                server.serve_forever()
+                server.server_close()
+            finally:
+                os._exit(0)
+        return pid
+
+    def spawn_workers():
+        # Objects tracked by the garbage collector at this point (the index) are never scanned again,
+        # which keeps collections in the workers from writing to (and thereby copying) their memory pages
+        gc.freeze()
+        return {spawn_worker() for _ in range(workers)}
+
+    worker_pids = spawn_workers()
+    retired_pids = set()
+    print(f"Serving on http://{host}:{port} with {workers} worker processes")
+
+    stopping = False
+    reload_requested = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for worker_pid in list(worker_pids):
+            os.kill(worker_pid, signal.SIGTERM)
+
+    def request_reload(signum, frame):
+        nonlocal reload_requested
+        reload_requested = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGHUP, request_reload)
+
+    next_watch = time.monotonic() + args.watch_interval
+    while worker_pids:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            worker_pids.discard(pid)
+            if not stopping and pid not in retired_pids:
+                print(f"Worker {pid} exited with status {status}, starting a new one")
+                worker_pids.add(spawn_worker())
+            retired_pids.discard(pid)
+            continue
+
+        if not stopping and args.watch_interval > 0 and time.monotonic() >= next_watch:
+            next_watch = time.monotonic() + args.watch_interval
+            reload_requested = reload_requested or index_changed()
+        if not stopping and reload_requested:
+            reload_requested = False
+            try:
+                set_image_matcher(load_image_matcher())
+            except Exception as e:
+                print(f"Error: Unable to reload the index, keeping the previous one: {e}")
+            else:
+                previous_pids = worker_pids - retired_pids
+                worker_pids |= spawn_workers()
+                retired_pids |= previous_pids
+                for worker_pid in previous_pids:
+                    os.kill(worker_pid, signal.SIGTERM)
+        time.sleep(0.2)
+    listen_socket.close()
+
+
+def init_metrics():
+    global server_metrics, profiler
+    server_metrics = ServerMetrics()
+    profiler = HistogramProfiler(server_metrics.stage_duration, MEASURED_STAGES)
+
+
+def run(args):
+    """Loads the index and serves the app with the parsed arguments of identify_server.py."""
+    global ABSOLUTE_PATH, matcher_shards, lazy_loading, memory_budget_mb
+    ABSOLUTE_PATH = os.path.abspath(args.base_dir)
+    if not args.no_metrics:
+        init_metrics()
+    if args.workers > 1 and not hasattr(os, 'fork'):
+        print("Warning: Multiple workers require os.fork, which is not available on this platform. "
+              "Running a single process instead.")
+        args.workers = 1
+    if args.workers > 1 and args.job_workers > 0:
+        print("Warning: Video jobs are only available with a single worker process, the job API is disabled.")
+    if args.workers > 1 and args.shards > 0:
+        print("Warning: Shards are only available with a single worker process, the index is searched by every "
+              "worker instead.")
+    elif args.shards > 0 and args.lazy:
+        print("Warning: Shards cannot be combined with --lazy, the index is searched in the server process instead.")
+    elif args.shards > 0:
+        matcher_shards = args.shards
+    if args.memory_budget_mb is not None and not args.lazy:
+        print("Warning: --memory_budget_mb only applies with --lazy and is ignored.")
+    lazy_loading = args.lazy
+    memory_budget_mb = args.memory_budget_mb
+    set_image_matcher(create_image_matcher(ABSOLUTE_PATH, args.search_filter or None, args.compact_distance))
+    print_index_layout(image_matcher.index_info())
+    if args.workers > 1:
+        serve_prefork(args)
+    else:
+        init_worker(args)
+        if args.watch_interval > 0:
+            threading.Thread(target=watch_index, args=(args.watch_interval,), name='index-watcher',
+                             daemon=True).start()
+        app.run(host=args.host, port=args.port)
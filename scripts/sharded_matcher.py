@@ -0,0 +1,132 @@
+import copy
+import multiprocessing
+import threading
+import numpy as np
+from image_matcher import ImageMatcher
+from stage_profiler import NULL_PROFILER
+
+
+def run_shard(shard, offset, connection):
+    """Worker process of a shard: answers (packed hashes, n, group_by_room) with the top n candidates of its rows."""
+    while True:
+        try:
+            query = connection.recv()
+        except EOFError:
+            break
+        if query is None:
+            break
+        packed_hashes, n, group_by_room = query
+        try:
+            candidates = shard.top_n_candidates(packed_hashes, n, group_by_room)
+            connection.send([(rows + offset, distances) for rows, distances in candidates])
+        except Exception as e:
+            connection.send(e)
+    connection.close()
+
+
+def shard_start_method():
+    """
+    Forked workers share the loaded index with this process, but a fork while other threads run (a reload in the
+    server, next to its batcher, job and watcher threads) copies the locks those threads hold into a child that can
+    then wait for them forever. The workers are then started by a fork server, or spawned on platforms without fork,
+    and sent their rows instead.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    if 'fork' in methods and threading.active_count() == 1:
+        return 'fork'
+    return 'forkserver' if 'forkserver' in methods else 'spawn'
+
+
+class ShardedMatcher(ImageMatcher):
+    """
+    An ImageMatcher that splits the rows of the index into equal row ranges, each searched by its own worker process.
+    A query is sent to every shard, each returns its top n candidates with their global rows, and the candidates are
+    merged by distance and row, so that the results are the same as those of an ImageMatcher, ties included.
+    With grouping by room, a shard returns its best row of its top n rooms: the shard holding the best row of one of
+    the top n rooms of the whole index also has that room among its own top n.
+    """
+
+    def __init__(self, base_dir, search_filter=None, profiler=None, compact_distance=None, shards=2):
+        super().__init__(base_dir, search_filter, profiler, compact_distance)
+        context = multiprocessing.get_context(shard_start_method())
+        self.lock = threading.Lock()
+        self.connections = []
+        self.processes = []
+        self.shards = max(shards, 1)
+        bounds = np.linspace(0, len(self.hash_matrix), self.shards + 1).astype(int)
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            shard = self.shard(start, stop)
+            connection, worker_connection = context.Pipe()
+            process = context.Process(target=run_shard, args=(shard, start, worker_connection),
+                                      name=f'matcher-shard-{len(self.processes)}', daemon=True)
+            process.start()
+            worker_connection.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+    def shard(self, start, stop):
+        """A plain ImageMatcher over the rows start to stop, without the strings and metadata it does not need."""
+        shard = copy.copy(self)
+        shard.__class__ = ImageMatcher
+        shard.profiler = NULL_PROFILER
+        shard.lock = shard.connections = shard.processes = shard.shards = None
+        shard.filenames = shard.room_keys = shard.room_metadata = []
+        shard.select_rows(np.arange(start, stop))
+        return shard
+
+    def subset(self, search_filter):
+        """Filtered searches run in this process, the shards always search the whole index."""
+        subset = super().subset(search_filter)
+        subset.__class__ = ImageMatcher
+        subset.lock = subset.connections = subset.processes = subset.shards = None
+        return subset
+
+    def match_image(self, image):
+        if not len(self.hash_matrix):
+            return None
+        return self.match_images_top_n([image], 1)[0][0]
+
+    def top_n_candidates(self, packed_hashes, n=1, group_by_room=False):
+        with self.lock:
+            for connection in self.connections:
+                connection.send((packed_hashes, n, group_by_room))
+            shard_results = [connection.recv() for connection in self.connections]
+        for shard_result in shard_results:
+            if isinstance(shard_result, Exception):
+                raise shard_result
+
+        results = []
+        for candidates in zip(*shard_results):
+            rows = np.concatenate([shard_rows for shard_rows, _ in candidates])
+            distances = np.concatenate([shard_distances for _, shard_distances in candidates])
+            order = np.lexsort((rows, distances))
+            if group_by_room:
+                # The first candidate of every room in the order is its best row
+                _, first = np.unique(self.room_ids[rows[order]], return_index=True)
+                order = order[np.sort(first)]
+            order = order[:n]
+            results.append((rows[order], distances[order]))
+        return results
+
+    def close(self):
+        """Stops the shard workers, a closed matcher cannot be searched anymore."""
+        for connection in self.connections:
+            try:
+                connection.send(None)
+            except OSError:
+                pass
+            connection.close()
+        for process in self.processes:
+            process.join(timeout=5)
+        self.connections = []
+        self.processes = []
+
+    def __del__(self):
+        # The workers of a replaced index stop once the last request using it is done
+        if getattr(self, 'connections', None):
+            self.close()
+
+    def index_info(self):
+        info = super().index_info()
+        info['shards'] = self.shards
+        return info
@@ -0,0 +1,55 @@
+import hashlib
+import json
+import os
+import time
+
+
+def file_identity(path):
+    """Absolute path, size and modification time of a file, which change when the file is replaced or rewritten."""
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+
+def fingerprint(inputs):
+    """Short hash of the inputs, which must be JSON serializable."""
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+class StageCache:
+    """
+    Records, in a JSON file, the fingerprint of the inputs of every stage of a run and the output file it wrote. A stage
+    can be skipped when it is run again with the same fingerprint and its output file was not changed since.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.stages = {}
+        if os.path.isfile(path):
+            try:
+                with open(path, 'r') as f:
+                    self.stages = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Warning: Ignoring the stage cache {path}: {e}")
+
+    def reusable(self, stage, inputs, output_file):
+        """The record of the stage if its output can be reused for these inputs, else None."""
+        record = self.stages.get(stage)
+        if record is None or record['fingerprint'] != fingerprint(inputs) or not os.path.isfile(output_file):
+            return None
+        if record['output'] != file_identity(output_file):
+            return None
+        return record
+
+    def record(self, stage, inputs, output_file):
+        """Records that the stage wrote output_file from these inputs and saves the cache."""
+        self.stages[stage] = {
+            'fingerprint': fingerprint(inputs),
+            'inputs': inputs,
+            'output': file_identity(output_file),
+            'completed_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        # Written to a temporary file first, so an interrupted run does not leave a broken cache
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, 'w') as f:
+            json.dump(self.stages, f, indent=4)
+        os.replace(temporary_path, self.path)
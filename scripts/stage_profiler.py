@@ -0,0 +1,109 @@
+import json
+import time
+from collections import defaultdict
+
+
+class _Stage:
+    __slots__ = ('durations', 'started')
+
+    def __init__(self, durations):
+        self.durations = durations
+
+    def __enter__(self):
+        self.started = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.durations.append(time.perf_counter_ns() - self.started)
+        return False
+
+
+class StageProfiler:
+    """
+    Measures named stages with a monotonic clock and counts events, cheap enough to leave around every frame:
+    a stage only appends its duration to a list, statistics are computed when the report is requested.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = defaultdict(list)
+        self.counters = defaultdict(int)
+
+    def stage(self, name):
+        return _Stage(self.durations[name])
+
+    def record(self, name, seconds):
+        self.durations[name].append(int(seconds * 1e9))
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def summary(self):
+        # numpy is only needed for the percentiles, and importing it would slow down the startup of every script
+        import numpy as np
+        wall_time = time.perf_counter() - self.started
+        stages = {}
+        for name, durations in self.durations.items():
+            if not durations:
+                continue
+            milliseconds = np.array(durations, dtype=np.float64) / 1e6
+            p50, p90, p99 = np.percentile(milliseconds, [50, 90, 99])
+            stages[name] = {
+                'count': len(milliseconds),
+                'total_s': round(milliseconds.sum() / 1000, 4),
+                'share': round(milliseconds.sum() / 1000 / wall_time, 4) if wall_time > 0 else None,
+                'mean_ms': round(milliseconds.mean(), 4),
+                'p50_ms': round(p50, 4),
+                'p90_ms': round(p90, 4),
+                'p99_ms': round(p99, 4),
+                'max_ms': round(milliseconds.max(), 4),
+            }
+        return {'wall_time_s': round(wall_time, 4), 'stages': stages, 'counters': dict(self.counters)}
+
+    def report(self):
+        summary = self.summary()
+        lines = [f"Profile over {summary['wall_time_s']:.2f}s wall time:",
+                 f"{'stage':<12} {'count':>8} {'total s':>9} {'share':>7} {'mean ms':>9} {'p50 ms':>9} "
+                 f"{'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}"]
+        for name, stage in sorted(summary['stages'].items(), key=lambda item: item[1]['total_s'], reverse=True):
+            lines.append(f"{name:<12} {stage['count']:>8} {stage['total_s']:>9.3f} {stage['share']:>7.1%} "
+                         f"{stage['mean_ms']:>9.3f} {stage['p50_ms']:>9.3f} {stage['p90_ms']:>9.3f} "
+                         f"{stage['p99_ms']:>9.3f} {stage['max_ms']:>9.3f}")
+        for name, value in sorted(summary['counters'].items()):
+            lines.append(f"{name}: {value}")
+        return '\n'.join(lines)
+
+    def write_json(self, path):
+        """Writes the summary together with the individual stage durations in milliseconds."""
+        trace = self.summary()
+        trace['trace_ms'] = {name: [round(duration / 1e6, 4) for duration in durations]
+                             for name, durations in self.durations.items()}
+        with open(path, 'w') as f:
+            json.dump(trace, f, indent=2)
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class NullProfiler:
+    """Profiler that measures nothing, used when profiling is disabled."""
+    _stage = _NullStage()
+
+    def stage(self, name):
+        return self._stage
+
+    def record(self, name, seconds):
+        pass
+
+    def count(self, name, amount=1):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
@@ -0,0 +1,61 @@
+import threading
+from collections import deque
+import numpy as np
+from image_matcher import POPCOUNT_TABLE
+
+
+class StreamSession:
+    """
+    State of one live identification stream.
+    Only the most recent frame is kept: a frame that arrives while the previous one still waits to be matched replaces
+    it, so a slow server skips frames instead of falling further and further behind the capture.
+    Consecutive frames of a capture mostly show the same room, so the results of recently matched hashes are kept and
+    reused for frames whose hash differs from one of them in at most locality_distance bits.
+    """
+
+    def __init__(self, locality_distance=2, locality_size=16):
+        self.condition = threading.Condition()
+        self.latest = None
+        self.closed = False
+        # Number of matches sent for every frame and whether to send one per room, can be changed by the client
+        self.n = 1
+        self.group_by_room = False
+        self.locality_distance = locality_distance
+        # (packed hash, n, group_by_room, matches) of the most recently matched frames
+        self.recent = deque(maxlen=locality_size)
+        self.counters = {'received': 0, 'dropped': 0, 'matched': 0, 'locality_hits': 0}
+
+    def offer(self, message):
+        with self.condition:
+            self.counters['received'] += 1
+            if self.latest is not None:
+                self.counters['dropped'] += 1
+            self.latest = message
+            self.condition.notify()
+
+    def take(self):
+        """Waits for the next frame and returns it, or returns None once the stream is closed."""
+        with self.condition:
+            while self.latest is None and not self.closed:
+                self.condition.wait()
+            message, self.latest = self.latest, None
+            return message
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+    def lookup(self, packed_hash, n, group_by_room=False):
+        for recent_hash, recent_n, recent_group_by_room, matches in reversed(self.recent):
+            if recent_n < n or recent_group_by_room != group_by_room:
+                continue
+            distance = POPCOUNT_TABLE[np.bitwise_xor(recent_hash, packed_hash)].sum()
+            if distance <= self.locality_distance:
+                self.counters['locality_hits'] += 1
+                return matches[:n]
+        return None
+
+    def remember(self, packed_hash, n, matches, group_by_room=False):
+        self.counters['matched'] += 1
+        self.recent.append((packed_hash, n, group_by_room, matches))
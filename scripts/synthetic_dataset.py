@@ -0,0 +1,165 @@
+import argparse
+import json
+import os
+import cv2
+import numpy as np
+
+DEFAULT_SLUGCATS = ('white', 'gourmand')
+DEFAULT_REGIONS = ('su', 'hi', 'ds', 'sl')
+SUBREGIONS = ('Outskirts', 'Industrial Complex', 'Drainage System', 'Shoreline', 'Chimney Canopy')
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Generate a synthetic MapExporter-style screenshot directory.')
+    parser.add_argument('base_dir', help='Directory to write the slugcat/region directories to.')
+    parser.add_argument('--slugcats', default=','.join(DEFAULT_SLUGCATS), help='Comma-separated slugcat names.')
+    parser.add_argument('--regions', default=','.join(DEFAULT_REGIONS), help='Comma-separated region acronyms.')
+    parser.add_argument('--rooms', type=int, default=20, help='Number of rooms per region.')
+    parser.add_argument('--cameras', type=int, default=2, help='Number of screenshots (cameras) per room.')
+    parser.add_argument('--width', type=int, default=320, help='Width of the screenshots in pixels.')
+    parser.add_argument('--height', type=int, default=180, help='Height of the screenshots in pixels.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator.')
+    parser.add_argument('--labelled_frames', type=int, default=0,
+                        help='Also write this many distorted frames of random screenshots and a labels.json '
+                             'for evaluate_matcher.py to the frames directory.')
+    parser.add_argument('--frames_dir', default='<base_dir>/frames', help='Directory for the labelled frames.')
+    return parser.parse_args()
+
+
+def room_name(region, index):
+    return f"{region.upper()}_A{index:02d}" if index < 100 else f"{region.upper()}_A{index}"
+
+
+def screenshot(rng, width, height):
+    """A blocky random image, so that the average hashes of different screenshots are far apart."""
+    blocks = rng.integers(0, 256, (9, 16, 3), dtype=np.uint8)
+    image = cv2.resize(blocks, (width, height), interpolation=cv2.INTER_NEAREST)
+    noise = rng.integers(-12, 13, image.shape, dtype=np.int16)
+    return np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def generate_dataset(base_dir, slugcats=DEFAULT_SLUGCATS, regions=DEFAULT_REGIONS, rooms_per_region=20,
+                     cameras_per_room=2, width=320, height=180, seed=0):
+    """
+    Writes screenshots and a metadata.json for every slugcat/region, laid out like the MapExporter output.
+    Returns one entry per screenshot with its slugcat, region, room_key, filename, path and room_metadata.
+    """
+    rng = np.random.default_rng(seed)
+    entries = []
+    for slugcat in slugcats:
+        for region in regions:
+            region_path = os.path.join(base_dir, slugcat, region)
+            os.makedirs(region_path, exist_ok=True)
+            rooms = {}
+            for room_index in range(rooms_per_region):
+                name = room_name(region, room_index)
+                room_metadata = {
+                    'name': name,
+                    'subregion': SUBREGIONS[room_index % len(SUBREGIONS)],
+                    'pos': [int(room_index % 10) * 50, int(room_index // 10) * 40],
+                    'cameras': [[camera * width, 0] for camera in range(cameras_per_room)],
+                    # Dropped by extract_hashes.py, like in the real metadata
+                    'tiles': [[0, 0, 0]] * 8,
+                    'nodes': [[0, 0]],
+                }
+                rooms[name] = room_metadata
+                for camera in range(cameras_per_room):
+                    filename = f"{name.lower()}_{camera}.png"
+                    path = os.path.join(region_path, filename)
+                    cv2.imwrite(path, screenshot(rng, width, height))
+                    entries.append({
+                        'slugcat': slugcat,
+                        'region': region,
+                        'room_key': name,
+                        'filename': filename,
+                        'path': path,
+                        'room_metadata': {key: value for key, value in room_metadata.items()
+                                          if key not in ('tiles', 'nodes')},
+                    })
+            with open(os.path.join(region_path, 'metadata.json'), 'w') as f:
+                json.dump({'rooms': rooms}, f)
+    return entries
+
+
+def capture_frame(image, rng, max_crop=0.04, max_brightness=20, noise=8):
+    """Distorts a screenshot like a frame of a recording: cropped and scaled back, brighter or darker, noisy."""
+    height, width = image.shape[:2]
+    left, right, top, bottom = (int(rng.integers(0, int(size * max_crop) + 1))
+                                for size in (width, width, height, height))
+    frame = cv2.resize(image[top:height - bottom, left:width - right], (width, height), interpolation=cv2.INTER_AREA)
+    frame = frame.astype(np.int16) + int(rng.integers(-max_brightness, max_brightness + 1))
+    frame += rng.integers(-noise, noise + 1, frame.shape, dtype=np.int16)
+    return np.clip(frame, 0, 255).astype(np.uint8)
+
+
+def generate_labelled_frames(entries, frames_dir, count, seed=0):
+    """Writes count distorted frames of random screenshots and a labels.json with their slugcat, region and room."""
+    rng = np.random.default_rng(seed)
+    os.makedirs(frames_dir, exist_ok=True)
+    labels = []
+    for index in range(count):
+        entry = entries[rng.integers(len(entries))]
+        filename = f"frame_{index:05d}.jpg"
+        cv2.imwrite(os.path.join(frames_dir, filename), capture_frame(cv2.imread(entry['path']), rng))
+        labels.append({'path': filename, 'slugcat': entry['slugcat'], 'region': entry['region'],
+                       'room_key': entry['room_key']})
+    labels_path = os.path.join(frames_dir, 'labels.json')
+    with open(labels_path, 'w') as f:
+        json.dump(labels, f, indent=2)
+    return labels_path
+
+
+def generate_route(entries, steps, seed=0, region_change_probability=0.05):
+    """
+    A walk through the screenshots like a player moves through the rooms: mostly within a region, rarely to another
+    region of the same slugcat. Returns one entry per step.
+    """
+    rng = np.random.default_rng(seed)
+    by_region = {}
+    for entry in entries:
+        by_region.setdefault((entry['slugcat'], entry['region']), []).append(entry)
+    region_keys = list(by_region)
+    slugcat, region = region_keys[0]
+    route = []
+    for _ in range(steps):
+        if rng.random() < region_change_probability:
+            same_slugcat = [key for key in region_keys if key[0] == slugcat]
+            slugcat, region = same_slugcat[rng.integers(len(same_slugcat))]
+        candidates = by_region[(slugcat, region)]
+        route.append(candidates[rng.integers(len(candidates))])
+    return route
+
+
+def format_timestamp(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{(seconds % 3600) // 60:02}:{seconds % 60:02}"
+
+
+def generate_events(entries, count, interval=10.0, seed=0):
+    """Events in the format written by process_video.py, one every interval seconds."""
+    route = generate_route(entries, count, seed)
+    return [{
+        'timestamp': format_timestamp(index * interval),
+        'slugcat': entry['slugcat'],
+        'region': entry['region'],
+        'filename': entry['filename'],
+        'room_key': entry['room_key'],
+        'room_metadata': entry['room_metadata'],
+        'distance': 0,
+    } for index, entry in enumerate(route)]
+
+
+def main():
+    args = parse_arguments()
+    entries = generate_dataset(args.base_dir, [item.strip() for item in args.slugcats.split(',')],
+                               [item.strip() for item in args.regions.split(',')], args.rooms, args.cameras,
+                               args.width, args.height, args.seed)
+    print(f"Generated {len(entries)} screenshots in {args.base_dir}")
+    if args.labelled_frames:
+        frames_dir = args.frames_dir.replace('<base_dir>', args.base_dir)
+        labels_path = generate_labelled_frames(entries, frames_dir, args.labelled_frames, args.seed)
+        print(f"Generated {args.labelled_frames} labelled frames: {labels_path}")
+
+
+if __name__ == '__main__':
+    main()
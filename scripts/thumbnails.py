@@ -0,0 +1,22 @@
+import os
+
+# Thumbnails are stored next to the hashes, in a subdirectory of every region directory
+THUMBNAIL_DIR = 'thumbnails'
+THUMBNAIL_FORMATS = ('webp', 'jpg')
+
+
+def thumbnail_filename(filename, thumbnail_format):
+    return os.path.splitext(filename)[0] + '.' + thumbnail_format
+
+
+def preview_path(image_path, base_dir='.'):
+    """
+    Path of the thumbnail of a screenshot, relative in the same way as the given screenshot path (resolved against
+    base_dir), or the screenshot path itself if no thumbnail was extracted for it.
+    """
+    image_dir, filename = os.path.split(image_path)
+    for thumbnail_format in THUMBNAIL_FORMATS:
+        thumbnail_path = os.path.join(image_dir, THUMBNAIL_DIR, thumbnail_filename(filename, thumbnail_format))
+        if os.path.isfile(os.path.join(base_dir, thumbnail_path)):
+            return thumbnail_path.replace(os.sep, '/')
+    return image_path
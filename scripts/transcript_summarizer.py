@@ -7,6 +7,45 @@ from threading import Lock
 from typing import List, Dict
 from CompletionClient import CompletionClient
 
+# Instructions of the summary of a transcript batch, followed by the text of the batch
+BATCH_PROMPT = (
+    "Instructions:\n\n"
+    "You are to generate a concise summary of a transcript section from the game **Rain World**. "
+    "Focus exclusively on significant events that advance the game's narrative or gameplay. These significant events include:\n\n"
+    "- **Obtaining new items or upgrades**\n"
+    "- **Discovering or discussing lore or specific story details**\n"
+    "- **Learning new information relevant to game progression**\n"
+    "- **Finding new, relevant areas or encountering significant characters**\n\n"
+    "Avoid including routine or insignificant actions, such as:\n\n"
+    "- The player dying or losing progress\n"
+    "- Random exploration without meaningful discoveries\n"
+    "- General commentary or actions that don't add new, significant information\n\n"
+    "**Summary Guidelines:**\n\n"
+    "- Provide a concise description of the key significant events, avoiding filler phrases and unnecessary commentary.\n"
+    "- Exclude generic introductions like 'Player does' or 'In this section'.\n"
+    "- **The summary must be no longer than 120 characters. If it exceeds 120 characters, your response will be rejected.**\n\n"
+    "**Format:**\n\n"
+    "- Provide the summary as a JSON object in this exact format: `{'summary': ''}`\n"
+    "- **Do not include any other text in your response.**\n\n"
+    "**If there are no significant events in the transcript (as per the criteria above), return:** `{'summary': ''}`\n\n"
+    "**Transcript Section:**\n\n"
+    "---\n"
+)
+
+# Prompt of the summary of the whole transcript, from the summaries of all batches
+FINAL_PROMPT = """
+You are tasked with interpreting and summarizing gameplay data from **Rain World**. Focus on providing a meaningful and cohesive summary.
+Avoid generic or repetitive descriptions, such as repeated deaths or insignificant actions. Provide concise and engaging insights.
+
+**Gameplay Data:**
+
+{combined_summaries}
+
+**Required Output:**
+Generate a JSON object summarizing the gameplay as: `{{'summary': 'YOUR SUMMARY HERE'}}`.
+Do not provide an introduction or talk about the fact that this is Rain World gameplay.
+"""
+
 
 def parse_transcript(file_path):
     with open(file_path, "r") as file:
@@ -93,27 +132,7 @@ def summarize_batches(client, batches: List[Dict], max_attempts=5, max_workers=5
                 ).strip()
 
             prompt = (
-                "Instructions:\n\n"
-                "You are to generate a concise summary of a transcript section from the game **Rain World**. "
-                "Focus exclusively on significant events that advance the game's narrative or gameplay. These significant events include:\n\n"
-                "- **Obtaining new items or upgrades**\n"
-                "- **Discovering or discussing lore or specific story details**\n"
-                "- **Learning new information relevant to game progression**\n"
-                "- **Finding new, relevant areas or encountering significant characters**\n\n"
-                "Avoid including routine or insignificant actions, such as:\n\n"
-                "- The player dying or losing progress\n"
-                "- Random exploration without meaningful discoveries\n"
-                "- General commentary or actions that don't add new, significant information\n\n"
-                "**Summary Guidelines:**\n\n"
-                "- Provide a concise description of the key significant events, avoiding filler phrases and unnecessary commentary.\n"
-                "- Exclude generic introductions like 'Player does' or 'In this section'.\n"
-                "- **The summary must be no longer than 120 characters. If it exceeds 120 characters, your response will be rejected.**\n\n"
-                "**Format:**\n\n"
-                "- Provide the summary as a JSON object in this exact format: `{'summary': ''}`\n"
-                "- **Do not include any other text in your response.**\n\n"
-                "**If there are no significant events in the transcript (as per the criteria above), return:** `{'summary': ''}`\n\n"
-                "**Transcript Section:**\n\n"
-                "---\n"
+                BATCH_PROMPT +
                 f"{batch['text']}\n"
                 # "---\n\n"
                 # "*Note: The following context is for reference only and should not be included or summarized in your response: "
@@ -165,20 +184,7 @@ def summarize_batches(client, batches: List[Dict], max_attempts=5, max_workers=5
 
 def summarize_entire_transcript(client, sections: List[Dict], max_attempts=5, final_summary_max_length=2000) -> str:
     combined_summaries = " ".join(section["summary"] for section in sections if section["summary"])
-    final_prompt = (
-f"""
-You are tasked with interpreting and summarizing gameplay data from **Rain World**. Focus on providing a meaningful and cohesive summary.
-Avoid generic or repetitive descriptions, such as repeated deaths or insignificant actions. Provide concise and engaging insights.
-
-**Gameplay Data:**
-
-{combined_summaries}
-
-**Required Output:**
-Generate a JSON object summarizing the gameplay as: `{{'summary': 'YOUR SUMMARY HERE'}}`.
-Do not provide an introduction or talk about the fact that this is Rain World gameplay.
-"""
-    )
+    final_prompt = FINAL_PROMPT.format(combined_summaries=combined_summaries)
 
     print("[overall] Generating the final coherent summary of the entire transcript.")
     complete_summary = ""
@@ -209,7 +215,7 @@ Do not provide an introduction or talk about the fact that this is Rain World ga
     return complete_summary
 
 
-def parse_arguments():
+def parse_arguments(argv=None):
     parser = argparse.ArgumentParser(description="Summarize a video transcript.")
     parser.add_argument("transcript_file", help="Path to the transcript file.")
     parser.add_argument("--output_file", default="none", help="Path to save the summary JSON file.")
@@ -218,34 +224,42 @@ def parse_arguments():
                         help="Maximum retry attempts for summarization per batch.")
     parser.add_argument("--base_url", required=True, help="Base URL for the completion API.")
     parser.add_argument("--model", required=True, help="Model name for the completion API.")
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 
-def main():
-    args = parse_arguments()
-    client = CompletionClient(base_url=args.base_url, model=args.model)
-
-    if args.output_file == "none":
-        args.output_file = f"{args.transcript_file}-summary.json"
+def summarize_transcript(client, transcript_file, batch_size=300, max_attempts=5, output_file=None):
+    """Summarize the batches of the transcript and the whole transcript, optionally saving them as JSON."""
+    entries = parse_transcript(transcript_file)
 
-    entries = parse_transcript(args.transcript_file)
-
-    batches = batch_transcript(entries, batch_size=args.batch_size)
+    batches = batch_transcript(entries, batch_size=batch_size)
     print(f"Transcript has {len(entries)} entries and {len(batches)} batches.")
 
-    summaries = summarize_batches(client, batches, max_attempts=args.max_attempts)
+    summaries = summarize_batches(client, batches, max_attempts=max_attempts)
     print(f"Summarized {len(summaries)} batches.")
 
-    complete_summary = summarize_entire_transcript(client, summaries, max_attempts=args.max_attempts)
+    complete_summary = summarize_entire_transcript(client, summaries, max_attempts=max_attempts)
 
     result = {
         "batches": summaries,
         "full": complete_summary
     }
 
-    with open(args.output_file, "w") as file:
-        json.dump(result, file, indent=2)
-    print(f"Summaries saved to {args.output_file}.")
+    if output_file:
+        with open(output_file, "w") as file:
+            json.dump(result, file, indent=2)
+        print(f"Summaries saved to {output_file}.")
+    return result
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    client = CompletionClient(base_url=args.base_url, model=args.model)
+
+    if args.output_file == "none":
+        args.output_file = f"{args.transcript_file}-summary.json"
+
+    summarize_transcript(client, args.transcript_file, batch_size=args.batch_size, max_attempts=args.max_attempts,
+                         output_file=args.output_file)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,132 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from process_video import process_video
+
+
+class VideoJob:
+    def __init__(self, video_file, search_filter=None, interval=10.0, start_time=0.0):
+        self.id = uuid.uuid4().hex[:12]
+        self.video_file = video_file
+        self.search_filter = search_filter
+        self.interval = interval
+        self.start_time = start_time
+        self.status = 'queued'
+        self.error = None
+        # Appended to by the worker while the video is processed
+        self.results = []
+        self.frames_processed = 0
+        self.position = start_time
+        self.duration = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+
+    def update_progress(self, frames_processed, position, duration):
+        self.frames_processed = frames_processed
+        self.position = position
+        self.duration = duration
+
+    def info(self):
+        info = {
+            'id': self.id,
+            'status': self.status,
+            'error': self.error,
+            'video_file': self.video_file,
+            'search_filter': self.search_filter,
+            'interval': self.interval,
+            'start_time': self.start_time,
+            'frames_processed': self.frames_processed,
+            'results': len(self.results),
+            'position_s': round(self.position, 3),
+            'duration_s': round(self.duration, 3) if self.duration is not None else None,
+            'frames_per_second': None,
+            'eta_s': None,
+        }
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+            if elapsed > 0 and self.frames_processed:
+                frames_per_second = self.frames_processed / elapsed
+                info['frames_per_second'] = round(frames_per_second, 3)
+                if self.status == 'running' and self.duration is not None:
+                    remaining_frames = max(0.0, self.duration - self.position) / self.interval
+                    info['eta_s'] = round(remaining_frames / frames_per_second, 1)
+        return info
+
+
+class VideoJobManager:
+    """
+    Runs video analysis jobs on a bounded pool of background threads, using the index already loaded by the server.
+    At most max_queued jobs wait for a free worker at any time, further submissions are rejected.
+    """
+
+    def __init__(self, get_matcher, max_workers=1, max_queued=4, max_finished=100):
+        self.get_matcher = get_matcher
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.max_finished = max_finished
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='video-job')
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def active_jobs(self):
+        return [job for job in self.jobs.values() if job.status in ('queued', 'running')]
+
+    def submit(self, video_file, search_filter=None, interval=10.0, start_time=0.0):
+        """Queues a new job and returns it, or returns None if the queue is full."""
+        with self.lock:
+            if len(self.active_jobs()) >= self.max_workers + self.max_queued:
+                return None
+            job = VideoJob(video_file, search_filter, interval, start_time)
+            self.jobs[job.id] = job
+            self.forget_finished_jobs()
+        self.executor.submit(self.run, job)
+        return job
+
+    def forget_finished_jobs(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.status not in ('queued', 'running')]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self.jobs[job_id]
+
+    def list_jobs(self):
+        """The jobs in the order they were submitted, taken while no submission forgets finished ones."""
+        with self.lock:
+            return list(self.jobs.values())
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is not None:
+            job.cancel_event.set()
+        return job
+
+    def run(self, job):
+        if job.cancel_event.is_set():
+            job.status = 'cancelled'
+            return
+        job.status = 'running'
+        job.started_at = time.time()
+        try:
+            matcher = self.get_matcher()
+            if job.search_filter:
+                matcher = matcher.subset(job.search_filter)
+            results = process_video(matcher, job.video_file, interval=job.interval, start_time=job.start_time,
+                                    results=job.results, on_progress=job.update_progress,
+                                    should_stop=job.cancel_event.is_set, verbose=False)
+            if results is None:
+                job.status = 'failed'
+                job.error = f"Unable to read video file {job.video_file}"
+            elif job.cancel_event.is_set():
+                job.status = 'cancelled'
+            else:
+                job.status = 'finished'
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()